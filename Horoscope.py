@@ -1,11 +1,18 @@
-from PIL import Image, ImageDraw, ImageFont
 import os
+import shutil
 import openai
 import asyncio
+import json
+import llm_client
+import metrics
+from horoscope_renderer import create_render_pool, render_job
 from telegram import Bot, InputMediaPhoto
+from telegram_sender import TelegramSender
+from tarot_library import TarotLibrary
+from media_registry import MediaRegistry
 import random
 import time
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 # API-ключи
 TELEGRAM_BOT_TOKEN = ""
@@ -19,6 +26,37 @@ TEMP_IMAGE_PATH = "./horoscope_images"
 TARO_PATH = os.path.join(os.path.expanduser("~"), "Desktop", "TARO")
 os.makedirs(TEMP_IMAGE_PATH, exist_ok=True)
 
+# Сохранять ли карточки на диск для архива (отправка идёт из памяти)
+SAVE_IMAGES_TO_DISK = False
+
+# Папка с заранее подготовленными выпусками (двухфазный режим: подготовка и публикация)
+BUNDLE_PATH = "./daily_bundle"
+# Сколько дней хранятся опубликованные выпуски
+BUNDLE_KEEP_DAYS = 7
+
+# Сколько изображений отправляется одной группой
+MEDIA_GROUP_SIZE = 6
+
+# Папка для JSON-сводок ежедневных запусков: время этапов и расход токенов (None — не сохранять)
+RUN_SUMMARY_PATH = "./run_summaries"
+
+# Сколько гороскопов генерируется одновременно: все знаки сразу, чтобы выпуск занимал время
+# самого долгого запроса. Лимит llm_client для модели поднимается до этого значения
+GENERATION_CONCURRENCY = 12
+
+# Генерация всех знаков одним запросом (отдельные запросы только для пропущенных знаков).
+# Выключено: рендер ждёт весь пакет, а отдельные запросы идут параллельно и рендерятся по мере готовности
+BATCH_GENERATION = False
+# Ответ на 12 знаков генерируется долго: свой таймаут и ограничение длины (около 300 токенов на знак)
+BATCH_TIMEOUT = 300
+BATCH_MAX_TOKENS = 4000
+
+# Варианты карточек для отрисовки (см. horoscope_renderer.IMAGE_VARIANTS), в канал уходит "square"
+RENDER_VARIANTS = ("square",)
+
+# Срок хранения описаний карт Таро в кэше ответов (в секундах)
+TARO_CACHE_TTL = 7 * 24 * 3600
+
 # Список знаков зодиака
 ZODIAC_SIGNS = [
     "Овен", "Телец", "Близнецы", "Рак",
@@ -56,80 +94,54 @@ TARO_CARDS = [
 def get_today_date():
     return datetime.now().strftime("%d.%m.%Y")
 
+HOROSCOPE_SYSTEM_PROMPT = "Ты генератор гороскопов. Отвечай реалистично и разнообразно, кратко, без использования эмодзи, в первом предложении всегда упоминай к какому знаку относится прогноз"
+
 # Функция для генерации гороскопа
-def generate_horoscope(sign):
+async def generate_horoscope(sign):
     prompt = f"Создай гороскоп на сегодня для знака зодиака {sign} в реалистичном стиле."
-    response = openai.ChatCompletion.create(
+    return await llm_client.complete(
         model="gpt-4",
         messages=[
-            {"role": "system", "content": "Ты генератор гороскопов. Отвечай реалистично и разнообразно, кратко, без использования эмодзи, в первом предложении всегда упоминай к какому знаку относится прогноз"},
+            {"role": "system", "content": HOROSCOPE_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
     )
-    return response.choices[0].message.content
-
-def create_horoscope_image(sign, text, output_path):
-    img_width, img_height = 1080, 1080
-    background_color = (255, 255, 255)  # Белый фон
-    text_color = (0, 0, 0)  # Чёрный текст
-    font_path = "/System/Library/Fonts/Supplemental/Arial.ttf"  # Проверьте путь шрифта
-    title_font_size = 70  # Увеличенный шрифт для заголовка
-    text_font_size = 40  # Обычный шрифт для текста
-    line_spacing = 20  # Межстрочный интервал
-
-    # Создание изображения
-    image = Image.new("RGB", (img_width, img_height), color=background_color)
-    draw = ImageDraw.Draw(image)
-    try:
-        title_font = ImageFont.truetype(font_path, title_font_size)
-        text_font = ImageFont.truetype(font_path, text_font_size)
-    except Exception as e:
-        print(f"Ошибка загрузки шрифта: {e}")
-        return
 
-    # Рисуем заголовок
-    title_bbox = draw.textbbox((0, 0), sign, font=title_font)
-    title_width = title_bbox[2] - title_bbox[0]
-    title_x = (img_width - title_width) / 2
-    title_y = 50  # Отступ сверху для заголовка
-    draw.text((title_x, title_y), sign, font=title_font, fill=text_color)
-
-    # Разбиение текста на строки
-    max_text_width = img_width - 100
-    words = text.split()
-    lines = []
-    current_line = ""
-
-    for word in words:
-        test_line = f"{current_line} {word}".strip()
-        test_line_bbox = draw.textbbox((0, 0), test_line, font=text_font)
-        test_line_width = test_line_bbox[2] - test_line_bbox[0]
-        if test_line_width <= max_text_width:
-            current_line = test_line
-        else:
-            lines.append(current_line)
-            current_line = word
-    lines.append(current_line)
-
-    # Центрирование текста ниже заголовка
-    text_y_start = title_y + title_font_size + 50  # Отступ после заголовка
-    total_text_height = len(lines) * (text_font_size + line_spacing)
-    y_offset = text_y_start + (img_height - text_y_start - total_text_height) // 2
-
-    for line in lines:
-        line_bbox = draw.textbbox((0, 0), line, font=text_font)
-        line_width = line_bbox[2] - line_bbox[0]
-        draw.text(((img_width - line_width) / 2, y_offset), line, font=text_font, fill=text_color)
-        y_offset += text_font_size + line_spacing
+# Генерация гороскопов для всех знаков одним запросом
+async def generate_horoscopes_batch(signs=ZODIAC_SIGNS):
+    prompt = (
+        f"Создай гороскопы на сегодня в реалистичном стиле для знаков зодиака: {', '.join(signs)}. "
+        f"Верни только JSON-объект без пояснений, где ключ — название знака, а значение — текст гороскопа."
+    )
+    content = await llm_client.complete(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": HOROSCOPE_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=BATCH_MAX_TOKENS,
+        timeout=BATCH_TIMEOUT
+    )
+    return parse_batch_horoscopes(content, signs)
 
+# Разбор и проверка ответа; в результат попадают только корректные знаки
+def parse_batch_horoscopes(content, signs=ZODIAC_SIGNS):
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end == -1:
+        return {}
     try:
-        image.save(output_path)
-        print(f"Изображение сохранено: {output_path}")
-    except Exception as e:
-        print(f"Ошибка сохранения изображения: {e}")
-
-
+        data = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
 
+    horoscopes = {}
+    for sign in signs:
+        text = data.get(sign)
+        if isinstance(text, str) and text.strip():
+            horoscopes[sign] = text.strip()
+    return horoscopes
 
 # # Функция для генерации влияния ретроградного Меркурия
 # def generate_mercury_effect():
@@ -143,46 +155,124 @@ def create_horoscope_image(sign, text, output_path):
 #     )
 #     return response.choices[0].message.content
 
-# Асинхронная функция для отправки медиа
-async def send_media_in_batches(bot, chat_id, media_files, batch_size=6, delay=5):
-    for i in range(0, len(media_files), batch_size):
+# Генерация и отрисовка гороскопа для одного знака
+async def generate_and_render(sign, semaphore, pool, variants, horoscope_text=None):
+    if horoscope_text is None:
+        async with semaphore:
+            horoscope_text = await generate_horoscope(sign)
+    # Рендер начинается в пуле процессов сразу после получения текста, не дожидаясь остальных знаков
+    loop = asyncio.get_running_loop()
+    output_dir = TEMP_IMAGE_PATH if SAVE_IMAGES_TO_DISK else None
+    with metrics.span("render"):
+        return await loop.run_in_executor(pool, render_job, sign, horoscope_text, output_dir, variants)
+
+
+# Параллельная генерация гороскопов для всех знаков
+async def build_horoscope_images(signs=ZODIAC_SIGNS, concurrency=GENERATION_CONCURRENCY, batch=BATCH_GENERATION,
+                                 variants=RENDER_VARIANTS):
+    batch_texts = {}
+    if batch:
+        try:
+            batch_texts = await generate_horoscopes_batch(signs)
+        except Exception as e:
+            print(f"Ошибка пакетной генерации гороскопов: {e}")
+        missing = [sign for sign in signs if sign not in batch_texts]
+        if missing:
+            print(f"Отдельная генерация для знаков: {', '.join(missing)}")
+
+    llm_client.ensure_model_concurrency("gpt-4", concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    with create_render_pool() as pool:
+        results = await asyncio.gather(
+            *(generate_and_render(sign, semaphore, pool, variants, batch_texts.get(sign)) for sign in signs),
+            return_exceptions=True
+        )
+
+    # Порядок знаков сохраняется, ошибка одного знака не мешает остальным
+    horoscope_images = {variant: [] for variant in variants}
+    for sign, result in zip(signs, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка при создании гороскопа для {sign}: {result}")
+            continue
+        for variant, data in result.items():
+            horoscope_images[variant].append(data)
+    return horoscope_images
+
+
+# Изображение для отправки: байты из памяти или путь к файлу
+def read_media(media):
+    if isinstance(media, (bytes, bytearray, memoryview)):
+        return bytes(media)
+    with open(media, "rb") as media_file:
+        return media_file.read()
+
+# Асинхронная функция для отправки медиа; паузы между группами выдерживает TelegramSender.
+# Возвращает номера отправленных групп; skip — группы, отправленные раньше (повтор публикации после сбоя)
+async def send_media_in_batches(sender, chat_id, media_files, batch_size=MEDIA_GROUP_SIZE, skip=()):
+    sent = []
+    for number, i in enumerate(range(0, len(media_files), batch_size)):
+        if number in skip:
+            continue
         batch = media_files[i:i + batch_size]
-        media_group = [InputMediaPhoto(open(file, "rb")) for file in batch]
+        media_group = [InputMediaPhoto(read_media(media)) for media in batch]
         try:
-            await bot.send_media_group(chat_id=chat_id, media=media_group)
+            await sender.send_media_group(chat_id, media_group)
+            sent.append(number)
             print(f"Отправлена группа из {len(batch)} изображений.")
         except Exception as e:
             print(f"Ошибка при отправке группы: {e}")
-        await asyncio.sleep(delay)
-
-# Генерация карты дня
-async def generate_card_of_the_day(bot):
-    card = random.choice(TARO_CARDS)
-    card_name = card["name"]
-    card_image = card["image"]
+    return sent
 
-    # Генерация описания карты
+# Генерация описания карты Таро
+async def generate_card_description(card_name, cache_ttl=None):
     prompt = f"Создай описание для карты Таро '{card_name}', объясни её значение и советы на день."
-    response = openai.ChatCompletion.create(
+    return await llm_client.complete(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "Ты эксперт по картам Таро. Отвечай кратко и ясно."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        cache_ttl=cache_ttl
     )
-    card_description = response.choices[0].message.content
 
-    # Отправка карты дня
+# Пополнение библиотеки описаний карт небольшими порциями (в ночные часы, если не force)
+async def refill_tarot_library(force=False):
+    generated = await TarotLibrary().top_up([card["name"] for card in TARO_CARDS], generate_card_description, force=force)
+    if generated:
+        print(f"В библиотеку Таро добавлено описаний: {generated}")
+    return generated
+
+# Выбор карты дня и её описания
+async def pick_card_of_the_day():
+    card = random.choice(TARO_CARDS)
+    card_name = card["name"]
+
+    # Готовое описание из библиотеки, при его отсутствии — генерация на месте
+    card_description = TarotLibrary().take(card_name)
+    if card_description is None:
+        card_description = await generate_card_description(card_name, cache_ttl=TARO_CACHE_TTL)
+    return card, card_description
+
+# Отправка карты дня
+async def send_card_of_the_day(sender, card, card_description):
     try:
-        with open(card_image, "rb") as image_file:
-            await bot.send_photo(
-                chat_id=CHANNEL_ID,
-                photo=image_file,
-                caption=f"🌟 Карта дня ({get_today_date()}): {card_name}\n\n{card_description}"
-            )
+        # Изображение карты загружается один раз, дальше отправляется по file_id
+        await MediaRegistry().send_photo(
+            sender,
+            CHANNEL_ID,
+            card["image"],
+            caption=f"🌟 Карта дня ({get_today_date()}): {card['name']}\n\n{card_description}"
+        )
         print("Карта дня отправлена.")
+        return True
     except Exception as e:
         print(f"Ошибка при отправке карты дня: {e}")
+        return False
+
+# Генерация карты дня
+async def generate_card_of_the_day(sender):
+    card, card_description = await pick_card_of_the_day()
+    await send_card_of_the_day(sender, card, card_description)
 
 # # Генерация влияния ретроградного Меркурия
 # async def generate_mercury_message(bot):
@@ -196,30 +286,128 @@ async def generate_card_of_the_day(bot):
 #     except Exception as e:
 #         print(f"Ошибка при отправке влияния ретроградного Меркурия: {e}")
 
-# Основной процесс
-async def main():
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+# Генерация и отправка гороскопов
+async def post_horoscopes(sender):
+    horoscope_images = await build_horoscope_images()
+    await send_media_in_batches(sender, CHANNEL_ID, horoscope_images["square"])
 
-    # Гороскопы
-    horoscope_images = []
-    for sign in ZODIAC_SIGNS:
-        try:
-            horoscope_text = generate_horoscope(sign)
-            output_path = os.path.join(TEMP_IMAGE_PATH, f"{sign}.jpg")
-            create_horoscope_image(sign, horoscope_text, output_path)
-            horoscope_images.append(output_path)
-        except Exception as e:
-            print(f"Ошибка при создании гороскопа для {sign}: {e}")
+# Основной процесс. Планировщик передаёт свой sender, чтобы переиспользовать бота и HTTP-соединения
+async def main(sender=None):
+    if sender is None:
+        async with Bot(token=TELEGRAM_BOT_TOKEN) as bot:
+            return await main(TelegramSender(bot))
 
-    # Отправка гороскопов
-    await send_media_in_batches(bot, CHANNEL_ID, horoscope_images)
+    # Гороскопы
+    await post_horoscopes(sender)
 
     # Карта дня
-    await generate_card_of_the_day(bot)
+    await generate_card_of_the_day(sender)
 
     # # Влияние ретроградного Меркурия
     # await generate_mercury_message(bot)
 
+# Подготовка и публикация выпуска не идут одновременно: после перезапуска догоняющие запуски
+# обеих фаз стартуют вместе, и публикация должна дождаться подготовки, а не генерировать всё заново
+bundle_lock = asyncio.Lock()
+
+# Папка выпуска на указанную дату
+def get_bundle_dir(day=None):
+    return os.path.join(BUNDLE_PATH, (day or date.today()).isoformat())
+
+# Фаза подготовки: тексты, карточки и карта дня заранее сохраняются как готовый к отправке выпуск.
+# manifest.json записывается последним, поэтому недописанный выпуск не будет опубликован
+async def prepare_daily_bundle(day=None):
+    async with bundle_lock:
+        return await _prepare_daily_bundle(day)
+
+async def _prepare_daily_bundle(day):
+    bundle_dir = get_bundle_dir(day)
+    if os.path.exists(os.path.join(bundle_dir, "published")):
+        print(f"Выпуск уже опубликован, подготовка не нужна: {bundle_dir}")
+        return bundle_dir
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    horoscope_images = await build_horoscope_images()
+    image_files = []
+    for i, data in enumerate(horoscope_images["square"]):
+        file_name = f"{i:02d}.jpg"
+        with open(os.path.join(bundle_dir, file_name), "wb") as image_file:
+            image_file.write(data)
+        image_files.append(file_name)
+
+    card, card_description = await pick_card_of_the_day()
+    manifest = {
+        "horoscopes": image_files,
+        "card": {"name": card["name"], "image": card["image"], "description": card_description},
+    }
+    manifest_path = os.path.join(bundle_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    print(f"Выпуск подготовлен: {bundle_dir} ({len(image_files)} гороскопов)")
+    return bundle_dir
+
+# Фаза публикации: только отправка в Telegram. Если выпуск не подготовлен, выполняется полный процесс.
+# Отправленные части записываются в progress.json: повторный запуск досылает только недостающее,
+# а отметка published появляется, только когда отправлено всё
+async def publish_daily_bundle(sender, day=None):
+    async with bundle_lock:
+        await _publish_daily_bundle(sender, day)
+
+async def _publish_daily_bundle(sender, day):
+    bundle_dir = get_bundle_dir(day)
+    manifest_path = os.path.join(bundle_dir, "manifest.json")
+    published_path = os.path.join(bundle_dir, "published")
+    if os.path.exists(published_path):
+        print(f"Выпуск уже опубликован: {bundle_dir}")
+        return
+    if not os.path.exists(manifest_path):
+        print(f"Выпуск не подготовлен, запуск полного процесса: {bundle_dir}")
+        await main(sender)
+        # Отметка не даёт запоздавшей подготовке сгенерировать уже отправленный выпуск
+        os.makedirs(bundle_dir, exist_ok=True)
+        with open(published_path, "w", encoding="utf-8") as published_file:
+            published_file.write(datetime.now().isoformat())
+        return
+
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    image_paths = [os.path.join(bundle_dir, file_name) for file_name in manifest["horoscopes"]]
+    progress_path = os.path.join(bundle_dir, "progress.json")
+    progress = {"groups": [], "card": False}
+    if os.path.exists(progress_path):
+        with open(progress_path, encoding="utf-8") as progress_file:
+            progress = json.load(progress_file)
+
+    progress["groups"] += await send_media_in_batches(sender, CHANNEL_ID, image_paths, skip=progress["groups"])
+    if not progress["card"]:
+        progress["card"] = await send_card_of_the_day(sender, manifest["card"], manifest["card"]["description"])
+    with open(progress_path, "w", encoding="utf-8") as progress_file:
+        json.dump(progress, progress_file)
+
+    group_count = len(range(0, len(image_paths), MEDIA_GROUP_SIZE))
+    if len(progress["groups"]) < group_count or not progress["card"]:
+        raise RuntimeError(f"Выпуск {bundle_dir} отправлен не полностью, недостающее будет отправлено при повторе")
+
+    with open(published_path, "w", encoding="utf-8") as published_file:
+        published_file.write(datetime.now().isoformat())
+    remove_old_bundles()
+
+# Удаление опубликованных выпусков старше keep_days дней; неопубликованные остаются для разбора
+def remove_old_bundles(keep_days=BUNDLE_KEEP_DAYS, today=None):
+    if not os.path.isdir(BUNDLE_PATH):
+        return
+    oldest = (today or date.today()) - timedelta(days=keep_days)
+    for name in os.listdir(BUNDLE_PATH):
+        bundle_dir = os.path.join(BUNDLE_PATH, name)
+        try:
+            bundle_day = date.fromisoformat(name)
+        except ValueError:
+            continue
+        if bundle_day < oldest and os.path.exists(os.path.join(bundle_dir, "published")):
+            shutil.rmtree(bundle_dir, ignore_errors=True)
+            print(f"Удалён старый выпуск: {bundle_dir}")
+
 # Запуск
 if __name__ == "__main__":
     asyncio.run(main())
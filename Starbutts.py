@@ -1,7 +1,8 @@
+import time
+_import_started = time.perf_counter()
+
 import logging
-import swisseph as swe
-from geopy.geocoders import Nominatim
-from timezonefinder import TimezoneFinder
+import threading
 from pytz import timezone, utc
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -9,17 +10,32 @@ from telegram.ext import Application, CommandHandler, CallbackQueryHandler, Mess
 import openai
 import os
 from dotenv import load_dotenv
-from fpdf import FPDF
-from skyfield.api import load
-from datetime import datetime
+import llm_client
+import chart_engine
+import metrics
+from telegram_sender import GLOBAL_LIMIT, StreamingReply, TelegramSender
+from geo_cache import GeoCache
+from chart_engine import compute_chart_async, format_planets, format_houses
+from workers import blocking_pool, run_in_pool
+from pdf_builder import PdfBuilder
+from request_queue import RequestQueue, ACCEPTED, DUPLICATE, FULL
+from startup import StartupReport, start_warm_up, wait_warm_up
+from state_store import create_state_store
+from update_processor import UserOrderedUpdateProcessor
+from prompt_builder import build_prompt, encode_chart
 from telegram import ReplyKeyboardMarkup
 
+startup_report = StartupReport(started=_import_started)
+startup_report.mark("импорт модулей")
+
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Укажите токены
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Адрес Bot API (например, локального сервера telegram-bot-api); по умолчанию api.telegram.org
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 openai.api_key = OPENAI_API_KEY
 
@@ -34,42 +50,133 @@ logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger('urllib3').setLevel(logging.WARNING)
 
-# Установка пути к файлам эфемерид
-swe.set_ephe_path('./ephemeris')
+# Geopy и TimezoneFinder загружаются при первом обращении или при прогреве перед запуском
+_geocode = None
+_timezone_finder = None
+_geocode_lock = threading.Lock()
+_timezone_lock = threading.Lock()
 
-# Инициализация Geopy и TimezoneFinder
-geolocator = Nominatim(user_agent="astro_app")
-tf = TimezoneFinder()
+# Кэш координат и часовых поясов, предзаполненный списком крупных городов
+geo_cache = GeoCache()
+geo_cache.seed_from_csv()
+startup_report.mark("кэш городов")
 
+# Режим webhook: адрес, на который Telegram присылает обновления, и число рабочих процессов
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WORKER_COUNT = int(os.getenv("STARBUTTS_WORKERS", "1"))
 
-# Преобразование градуса в знак зодиака
-def degree_to_sign(degree):
-    signs = [
-        "Овен", "Телец", "Близнецы", "Рак",
-        "Лев", "Дева", "Весы", "Скорпион",
-        "Стрелец", "Козерог", "Водолей", "Рыбы"
-    ]
-    sign_index = int(degree // 30)
-    degree_in_sign = degree % 30
-    return f"{signs[sign_index]} {degree_in_sign:.2f}°"
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя — по очереди)
+MAX_CONCURRENT_UPDATES = 64
 
+# Отправка ответов с учётом лимитов Telegram. Общий лимит бота делится между рабочими процессами
+GLOBAL_SEND_LIMIT = int(os.getenv("TELEGRAM_GLOBAL_LIMIT", str(GLOBAL_LIMIT[0])))
+sender = TelegramSender(global_limit=(max(1, GLOBAL_SEND_LIMIT // WORKER_COUNT), GLOBAL_LIMIT[1]))
 
-# Функция для получения координат и часового пояса
-def get_coordinates_and_timezone(location_name):
-    location = geolocator.geocode(location_name)
+# Состояние диалогов (шаг ввода, данные первого человека) хранится вне процесса:
+# переживает перезапуск и общее для нескольких процессов бота
+state_store = create_state_store()
+
+# Очередь тяжёлых запросов: ограничивает число одновременных расчётов и обращений к OpenAI
+request_queue = RequestQueue()
+
+# Порт эндпоинта /metrics (0 — не запускать)
+METRICS_PORT = int(os.getenv("STARBUTTS_METRICS_PORT", "9108"))
+
+# Показывать интерпретации по мере генерации, правя сообщение-заглушку
+STREAM_RESPONSES = True
+
+# Сроки хранения ответов в кэше (в секундах): одинаковые карты получают одинаковую трактовку,
+# повторно отправленный сон не оплачивается дважды
+CHART_CACHE_TTL = 30 * 24 * 3600
+DREAM_CACHE_TTL = 3600
+
+
+# Геокодер Nominatim; Nominatim допускает не больше одного запроса в секунду
+def get_geocoder():
+    global _geocode
+    with _geocode_lock:
+        if _geocode is None:
+            from geopy.geocoders import Nominatim
+            from geopy.extra.rate_limiter import RateLimiter
+            geolocator = Nominatim(user_agent="astro_app")
+            _geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+    return _geocode
+
+
+def get_timezone_finder():
+    global _timezone_finder
+    with _timezone_lock:
+        if _timezone_finder is None:
+            from timezonefinder import TimezoneFinder
+            _timezone_finder = TimezoneFinder()
+    return _timezone_finder
+
+
+# Загрузка полигонов часовых поясов пробным запросом
+def warm_up_timezones():
+    get_timezone_finder().timezone_at(lng=37.62, lat=55.75)
+
+
+# Запрос координат и часового пояса через Nominatim и TimezoneFinder
+def fetch_coordinates_and_timezone(location_name):
+    with metrics.span("geocode"):
+        location = get_geocoder()(location_name)
     if not location:
         raise ValueError(f"Место не найдено: {location_name}")
 
     latitude = location.latitude
     longitude = location.longitude
 
-    tz_name = tf.timezone_at(lng=longitude, lat=latitude)
+    with metrics.span("timezone"):
+        tz_name = get_timezone_finder().timezone_at(lng=longitude, lat=latitude)
     if not tz_name:
         raise ValueError(f"Не удалось определить часовой пояс для координат: {latitude}, {longitude}")
 
     return latitude, longitude, tz_name
 
 
+# Функция для получения координат и часового пояса (с кэшем)
+def get_coordinates_and_timezone(location_name):
+    return geo_cache.resolve(location_name, fetch_coordinates_and_timezone)
+
+
+# Асинхронная версия: попадание в память отвечает сразу, остальное выполняется в пуле потоков
+async def get_coordinates_and_timezone_async(location_name):
+    cached = geo_cache.peek(location_name)
+    if cached is not None:
+        return cached
+    return await run_in_pool(blocking_pool, get_coordinates_and_timezone, location_name)
+
+
+# Запрос к модели с отправкой ответа пользователю: потоково или одним сообщением.
+# prompt — результат prompt_builder.build_prompt, flow — его сценарий
+async def reply_with_completion(message, prefix, model, prompt, flow, cache_ttl=None):
+    messages, max_tokens = prompt.messages, prompt.max_tokens
+    if STREAM_RESPONSES:
+        cached = llm_client.cached_completion(model, messages, max_tokens) if cache_ttl else None
+        if cached is not None:
+            chunks = _single_chunk(cached)
+        else:
+            chunks = llm_client.stream_completion(
+                model=model, messages=messages, max_tokens=max_tokens, flow=flow, prompt_tokens=prompt.prompt_tokens
+            )
+        text = await StreamingReply(sender, message, prefix).stream(chunks)
+        if cache_ttl and cached is None and text:
+            llm_client.store_completion(model, messages, max_tokens, text, cache_ttl)
+        return text
+
+    text = await llm_client.complete(
+        model=model, messages=messages, max_tokens=max_tokens, cache_ttl=cache_ttl, flow=flow
+    )
+    await sender.reply_text(message, f"{prefix}{text}")
+    return text
+
+
+# Готовый текст в виде потока из одной части (ответ из кэша)
+async def _single_chunk(text):
+    yield text
+
+
 # Функция для конвертации времени в UTC
 def convert_to_utc(date, time, tz_name):
     local_tz = timezone(tz_name)
@@ -79,77 +186,27 @@ def convert_to_utc(date, time, tz_name):
     return utc_time
 
 
-# Расчёт натальной карты
-def calculate_chart(year, month, day, hour, latitude, longitude):
-    julian_day = swe.julday(year, month, day, hour)
-    planets = {
-        "Солнце": swe.SUN,
-        "Луна": swe.MOON,
-        "Меркурий": swe.MERCURY,
-        "Венера": swe.VENUS,
-        "Марс": swe.MARS,
-        "Юпитер": swe.JUPITER,
-        "Сатурн": swe.SATURN,
-        "Уран": swe.URANUS,
-        "Нептун": swe.NEPTUNE,
-        "Плутон": swe.PLUTO,
-    }
-    chart = {}
-    for planet_name, planet_code in planets.items():
-        planet_pos = swe.calc_ut(julian_day, planet_code)[0][0]
-        chart[planet_name] = degree_to_sign(planet_pos)
-
-    return chart
-
-
-# Расчёт домов
-def calculate_houses(year, month, day, hour, latitude, longitude):
-    julian_day = swe.julday(year, month, day, hour)
-    house_positions = swe.houses(julian_day, latitude, longitude, b'P')  # Система домов Плацидуса
-    house_cusps = house_positions[0]  # Границы домов
-    ascendant = degree_to_sign(house_positions[1][0])  # Асцендент
-    houses = {f"Дом {i+1}": degree_to_sign(house_cusps[i]) for i in range(len(house_cusps))}
-    return houses, ascendant
-
-
-# Функция для создания PDF
-def create_pdf(chart, houses, ascendant, detailed_interpretation):
-    pdf = FPDF()
-    pdf.add_page()
-
-    # Указываем путь к шрифтам
-    pdf.add_font('DejaVu', '', './fonts/DejaVuSans.ttf', uni=True)
-    pdf.add_font('DejaVu', 'B', './fonts/DejaVuSans-Bold.ttf', uni=True)
-    pdf.add_font('DejaVu', 'I', './fonts/DejaVuSans-Oblique.ttf', uni=True)
-    pdf.set_font("DejaVu", size=12)
-
-    pdf.cell(200, 10, txt="Натальная карта", ln=True, align='C')
-    pdf.ln(10)
-
-    pdf.set_font("DejaVu", style="B", size=12)
-    pdf.cell(200, 10, txt="Планеты и Асцендент", ln=True, align='L')
-    pdf.set_font("DejaVu", size=12)
-    for key, value in chart.items():
-        pdf.cell(200, 10, txt=f"{key}: {value}", ln=True, align='L')
-
-    pdf.ln(10)
-    pdf.set_font("DejaVu", style="B", size=12)
-    pdf.cell(200, 10, txt="Дома", ln=True, align='L')
-    pdf.set_font("DejaVu", size=12)
-    for key, value in houses.items():
-        pdf.cell(200, 10, txt=f"{key}: {value}", ln=True, align='L')
-
-    pdf.cell(200, 10, txt=f"Асцендент: {ascendant}", ln=True, align='L')
-
-    pdf.ln(10)
-    pdf.set_font("DejaVu", style="B", size=12)
-    pdf.cell(200, 10, txt="Детальная интерпретация", ln=True, align='L')
-    pdf.set_font("DejaVu", size=12)
-    pdf.multi_cell(0, 10, detailed_interpretation)
-
-    file_path = "./natal_chart.pdf"
-    pdf.output(file_path)
-    return file_path
+# Сборщик PDF: шрифты разбираются один раз, документы собираются в памяти
+pdf_builder = PdfBuilder()
+
+
+# Постановка тяжёлого запроса в очередь с ответом пользователю о его судьбе; возвращает статус
+async def enqueue_request(update, job_type, job):
+    status, position = request_queue.submit(update.effective_user.id, job_type, job)
+    if status == DUPLICATE:
+        await sender.reply_text(update.message, "Ваш предыдущий запрос ещё обрабатывается, пожалуйста, подождите.")
+    elif status == FULL:
+        logger.warning(f"Очередь запросов переполнена: {request_queue.stats()}")
+        await sender.reply_text(update.message, "Сейчас слишком много запросов. Пожалуйста, попробуйте через несколько минут.")
+    elif position:
+        await sender.reply_text(update.message, f"Ваш запрос принят. Место в очереди: {position}")
+    return status
+
+
+# Функция для создания PDF (выполняется в пуле потоков, результат — байты файла)
+async def create_pdf(chart, houses, ascendant, detailed_interpretation):
+    with metrics.span("pdf"):
+        return await run_in_pool(blocking_pool, pdf_builder.build_natal_chart, chart, houses, ascendant, detailed_interpretation)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -167,13 +224,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Отправляем сообщение с основным меню
-    await update.message.reply_text(
+    await sender.reply_text(
+        update.message,
         "Добро пожаловать! Выберите действие:",
         reply_markup=reply_markup
     )
 
     # Добавляем кнопку "Старт" для повторного запуска
-    await update.message.reply_text(
+    await sender.reply_text(
+        update.message,
         "Для перезапуска меню нажмите 'Старт'.",
         reply_markup=markup
     )
@@ -184,37 +243,49 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     if query.data == 'create_chart':
-        await query.message.reply_text(
+        await sender.reply_text(
+            query.message,
             "Введите данные в формате:\nИмя, Дата рождения (ДД.ММ.ГГГГ), Время рождения (ЧЧ:ММ), Город\n"
             "Пример: Екатерина, 01.10.2002, 14:10, Москва"
         )
-        context.user_data['awaiting_data'] = 'individual'
+        await state_store.save(query.from_user.id, {'awaiting_data': 'individual'})
 
     elif query.data == 'calculate_compatibility':
-        await query.message.reply_text(
+        await sender.reply_text(
+            query.message,
             "Введите данные первого человека в формате:\nИмя, Дата рождения (ДД.ММ.ГГГГ), Время рождения (ЧЧ:ММ), Город\n"
             "Пример: Екатерина, 01.10.2002, 14:10, Москва"
         )
-        context.user_data['awaiting_data'] = 'person1'
+        await state_store.save(query.from_user.id, {'awaiting_data': 'person1'})
 
     elif query.data == 'financial_analysis':
-        await query.message.reply_text(
+        await sender.reply_text(
+            query.message,
             "Введите данные в формате:\nИмя, Дата рождения (ДД.ММ.ГГГГ), Время рождения (ЧЧ:ММ), Город\n"
             "Пример: Иван, 01.01.1990, 12:00, Москва"
         )
-        context.user_data['awaiting_data'] = 'financial'
+        await state_store.save(query.from_user.id, {'awaiting_data': 'financial'})
 
     elif query.data == 'dream_interpretation':
-        await query.message.reply_text(
+        await sender.reply_text(
+            query.message,
             "Введите описание вашего сна. Например: \"Я видел, как летал над лесом, а затем встретил белую лошадь.\""
         )
-        context.user_data['awaiting_data'] = 'dream'
-
+        await state_store.save(query.from_user.id, {'awaiting_data': 'dream'})
 
-from telegram import ReplyKeyboardMarkup
 
-# Обработчик сообщений с добавлением кнопки "Старт"
+# Обработчик сообщений: состояние диалога берётся из хранилища и записывается обратно, только если изменилось
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    state = await state_store.load(user_id)
+    original = dict(state)
+    await dispatch_message(update, context, state)
+    if state != original:
+        await state_store.save(user_id, state)
+
+
+# Разбор сообщения по шагу диалога, с добавлением кнопки "Старт"
+async def dispatch_message(update: Update, context: ContextTypes.DEFAULT_TYPE, state: dict):
     # Логируем данные, введенные пользователем
     user_input = update.message.text.strip().lower()
     user_name = update.message.from_user.full_name
@@ -225,94 +296,103 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await start(update, context)
         return
 
-    if context.user_data.get('awaiting_data') == 'individual':
-        await calculate_individual_chart(update, context)
+    if state.get('awaiting_data') == 'individual':
+        await enqueue_request(update, 'individual', lambda: calculate_individual_chart(update, context))
 
-    elif context.user_data.get('awaiting_data') == 'financial':
-        try:
-            # Парсим данные пользователя
-            data = user_input.split(",")
-            if len(data) != 4:
-                await update.message.reply_text(
-                    "Ошибка! Формат ввода: Имя, Дата рождения (ДД.ММ.ГГГГ), Время (ЧЧ:ММ), Город"
-                )
-                return
+    elif state.get('awaiting_data') == 'financial':
+        await enqueue_request(update, 'financial', lambda: handle_financial_request(update, context))
 
-            name, date, time, location = map(str.strip, data)
-            logger.info(f"Пользователь {user_name} ввел данные для финансового анализа: Имя={name}, Дата={date}, Время={time}, Город={location}")
-
-            # Получаем координаты и часовой пояс
-            latitude, longitude, tz_name = get_coordinates_and_timezone(location)
-
-            # Конвертируем время в UTC
-            utc_time = convert_to_utc(date, time, tz_name)
-
-            # Вызываем функцию анализа
-            await calculate_financial_analysis(update, context, name, utc_time, latitude, longitude)
-
-        except Exception as e:
-            logger.error(f"Ошибка обработки данных: {str(e)}")
-            await update.message.reply_text("Произошла ошибка. Проверьте формат ввода.")
-
-    elif context.user_data.get('awaiting_data') == 'person1':
+    elif state.get('awaiting_data') == 'person1':
         # Сохраняем данные первого человека
-        context.user_data['person1_data'] = user_input
+        state['person1_data'] = user_input
         logger.info(f"Пользователь {user_name} ввел данные для первого человека: {user_input}")
-        await update.message.reply_text(
+        await sender.reply_text(
+            update.message,
             "Введите данные второго человека в формате:\nИмя, Дата рождения (ДД.ММ.ГГГГ), Время рождения (ЧЧ:ММ), Город\n"
             "Пример: Иван, 05.06.1990, 10:30, Санкт-Петербург"
         )
-        context.user_data['awaiting_data'] = 'person2'
+        state['awaiting_data'] = 'person2'
 
-    elif context.user_data.get('awaiting_data') == 'person2':
-        # Сохраняем данные второго человека
-        context.user_data['person2_data'] = user_input
+    elif state.get('awaiting_data') == 'person2':
+        # Данные фиксируются сейчас: пока запрос ждёт в очереди, пользователь может начать новый ввод
+        person1_data = state['person1_data']
         logger.info(f"Пользователь {user_name} ввел данные для второго человека: {user_input}")
-        await calculate_compatibility(update, context)
-        context.user_data['awaiting_data'] = None  # Сбрасываем состояние
+        status = await enqueue_request(
+            update, 'compatibility',
+            lambda: calculate_compatibility(update, context, person1_data, user_input)
+        )
+        # Состояние сбрасывается только для принятого запроса: при отказе данные первого человека сохраняются
+        if status == ACCEPTED:
+            state.clear()
 
-    elif context.user_data.get('awaiting_data') == 'dream':
+    elif state.get('awaiting_data') == 'dream':
         logger.info(f"Пользователь {user_name} ввел описание сна: {user_input}")
-        await interpret_dream(update, context)
-        context.user_data['awaiting_data'] = None  # Сбрасываем состояние
+        if await enqueue_request(update, 'dream', lambda: interpret_dream(update, context)) == ACCEPTED:
+            state.clear()  # Сбрасываем состояние
 
     else:
         # Сообщение, если пользователь ввел что-то некорректное
         reply_keyboard = [["Старт"]]
         markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True, one_time_keyboard=False)
-        await update.message.reply_text(
+        await sender.reply_text(
+            update.message,
             "Непонятный запрос. Нажмите 'Старт', чтобы вернуться в главное меню.",
             reply_markup=markup
         )
 
 
+# Разбор данных для финансового анализа и сам анализ (выполняется в очереди запросов)
+async def handle_financial_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_input = update.message.text.strip().lower()
+    user_name = update.message.from_user.full_name
+    try:
+        # Парсим данные пользователя
+        data = user_input.split(",")
+        if len(data) != 4:
+            await sender.reply_text(
+                update.message,
+                "Ошибка! Формат ввода: Имя, Дата рождения (ДД.ММ.ГГГГ), Время (ЧЧ:ММ), Город"
+            )
+            return
+
+        name, date, time, location = map(str.strip, data)
+        logger.info(f"Пользователь {user_name} ввел данные для финансового анализа: Имя={name}, Дата={date}, Время={time}, Город={location}")
+
+        # Получаем координаты и часовой пояс
+        latitude, longitude, tz_name = await get_coordinates_and_timezone_async(location)
+
+        # Конвертируем время в UTC
+        utc_time = convert_to_utc(date, time, tz_name)
+
+        # Вызываем функцию анализа
+        await calculate_financial_analysis(update, context, name, utc_time, latitude, longitude)
+
+    except Exception as e:
+        logger.error(f"Ошибка обработки данных: {str(e)}")
+        await sender.reply_text(update.message, "Произошла ошибка. Проверьте формат ввода.")
+
+
 async def interpret_dream(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # Получаем описание сна от пользователя
         dream_description = update.message.text
 
-        # Генерация толкования сна через OpenAI API
-        dream_prompt = (
-            f"Ты профессиональный толкователь снов. Пользователь описал свой сон следующим образом:\n"
-            f"\"{dream_description}\"\n"
-            f"Пожалуйста, дай подробное, но реалистичное толкование этого сна, выдели основные символы и их значение, "
-            f"а также общий смысл сна и возможные рекомендации для пользователя."
-        )
+        # Генерация толкования сна через OpenAI API; слишком длинное описание обрезается под бюджет
+        dream_prompt = build_prompt("dream", dream_description, "gpt-4", trim=True)
 
-        response = openai.ChatCompletion.create(
+        # Генерация и отправка толкования пользователю
+        await reply_with_completion(
+            update.message,
+            "Толкование сна:\n\n",
             model="gpt-4",
-            messages=[{"role": "user", "content": dream_prompt}],
-            max_tokens=1500
+            prompt=dream_prompt,
+            flow="dream",
+            cache_ttl=DREAM_CACHE_TTL
         )
 
-        interpretation = response['choices'][0]['message']['content'].strip()
-
-        # Отправка толкования пользователю
-        await update.message.reply_text(f"Толкование сна:\n\n{interpretation}")
-
     except Exception as e:
         logger.error(f"Ошибка толкования сна: {str(e)}")
-        await update.message.reply_text("Произошла ошибка при толковании сна. Пожалуйста, попробуйте снова.")
+        await sender.reply_text(update.message, "Произошла ошибка при толковании сна. Пожалуйста, попробуйте снова.")
 
 
 async def calculate_individual_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -320,7 +400,8 @@ async def calculate_individual_chart(update: Update, context: ContextTypes.DEFAU
         # Парсим данные
         data = update.message.text.split(",")
         if len(data) != 4:
-            await update.message.reply_text(
+            await sender.reply_text(
+                update.message,
                 "Ошибка! Формат ввода: Имя, Дата рождения (ДД.ММ.ГГГГ), Время (ЧЧ:ММ), Город"
             )
             return
@@ -328,170 +409,176 @@ async def calculate_individual_chart(update: Update, context: ContextTypes.DEFAU
         name, date, time, location = map(str.strip, data)
 
         # Получаем координаты и часовой пояс
-        latitude, longitude, tz_name = get_coordinates_and_timezone(location)
+        latitude, longitude, tz_name = await get_coordinates_and_timezone_async(location)
 
         # Конвертируем время в UTC
         utc_time = convert_to_utc(date, time, tz_name)
 
-        # Рассчитываем натальную карту
-        hour_utc = utc_time.hour + utc_time.minute / 60.0
-        chart = calculate_chart(utc_time.year, utc_time.month, utc_time.day, hour_utc, latitude, longitude)
-
-        # Рассчитываем дома
-        houses, ascendant = calculate_houses(utc_time.year, utc_time.month, utc_time.day, hour_utc, latitude, longitude)
+        # Рассчитываем натальную карту и дома
+        natal_chart = await compute_chart_async(utc_time, latitude, longitude)
+        chart = format_planets(natal_chart)
+        houses, ascendant = format_houses(natal_chart)
 
         # Формируем вывод для пользователя
         result = "\n".join([f"{key}: {value}" for key, value in chart.items()])
         house_data = "\n".join([f"{key}: {value}" for key, value in houses.items()])
-        await update.message.reply_text(
+        await sender.reply_text(
+            update.message,
             f"Рассчитанные данные:\n\nПланеты:\n{result}\n\nДома:\n{house_data}\n\nАсцендент: {ascendant}"
         )
 
         # Запрос краткой интерпретации
-        short_prompt = (
-            f"Ты профессиональный астролог. Твоя задача — составить краткую, но реалистичную, убедительную и грамотно структурированную натальную карту "
-            f"на основе предоставленных данных. Структура ответа должна состоять из 8 пунктов описывающих влияние планет,пункта асцендента, а в конце общий вывод. Используй классические астрологические трактовки, уделяя внимание каждому аспекту, "
-            f"взаимодействиям планет и их влиянию на личность. ответ должен быть до 4000 символов. Избегай противоречий в трактовках. "
-            f"Вот данные:\nПланеты:\n{result}\nАсцендент: {ascendant}"
-        )
-        short_response = openai.ChatCompletion.create(
+        short_prompt = build_prompt("chart_short", encode_chart(natal_chart, houses=False), "gpt-3.5-turbo")
+        await reply_with_completion(
+            update.message,
+            "Краткая интерпретация:\n",
             model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": short_prompt}],
-            max_tokens=1500
+            prompt=short_prompt,
+            flow="chart_short",
+            cache_ttl=CHART_CACHE_TTL
         )
-        short_interpretation = short_response['choices'][0]['message']['content'].strip()
-        await update.message.reply_text(f"Краткая интерпретация:\n{short_interpretation}")
 
         # Полная интерпретация
-        detailed_prompt = (
-            f"Ты профессиональный астролог. Твоя задача — составить полную, реалистичную, убедительную и грамотно структурированную натальную карту "
-            f"на основе предоставленных данных. Структура ответа должна содержать: полное и детальное описание 10 планет, Детальное описание каждого дома по пунктам, общий полный вывод по всему описанию. Используй классические астрологические трактовки."
-            f"Ответ должен быть максимально полным и не противоречить краткому."
-            f"Планеты:\n{result}\nДома:\n{house_data}\nАсцендент: {ascendant}"
-        )
-        detailed_response = openai.ChatCompletion.create(
+        detailed_prompt = build_prompt("chart_detailed", encode_chart(natal_chart), "gpt-4")
+        detailed_interpretation = await llm_client.complete(
             model="gpt-4",
-            messages=[{"role": "user", "content": detailed_prompt}],
-            max_tokens=3000
+            messages=detailed_prompt.messages,
+            max_tokens=detailed_prompt.max_tokens,
+            cache_ttl=CHART_CACHE_TTL,
+            flow="chart_detailed"
         )
-        detailed_interpretation = detailed_response['choices'][0]['message']['content'].strip()
 
         # Создаем PDF
-        pdf_path = create_pdf(chart, houses, ascendant, detailed_interpretation)
+        pdf_data = await create_pdf(chart, houses, ascendant, detailed_interpretation)
 
         # Отправляем PDF пользователю
-        await update.message.reply_document(document=pdf_path)
+        await sender.reply_document(update.message, pdf_data, filename="natal_chart.pdf")
 
     except Exception as e:
         logger.error(f"Ошибка обработки данных: {str(e)}")
-        await update.message.reply_text("Произошла ошибка. Проверьте формат ввода.")
+        await sender.reply_text(update.message, "Произошла ошибка. Проверьте формат ввода.")
 
 
-async def calculate_compatibility(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def calculate_compatibility(update: Update, context: ContextTypes.DEFAULT_TYPE, person1_text: str, person2_text: str):
     try:
         # Извлекаем данные
-        person1_data = context.user_data['person1_data'].split(",")
-        person2_data = context.user_data['person2_data'].split(",")
+        person1_data = person1_text.split(",")
+        person2_data = person2_text.split(",")
 
         if len(person1_data) != 4 or len(person2_data) != 4:
-            await update.message.reply_text(
+            await sender.reply_text(
+                update.message,
                 "Ошибка! Проверьте формат ввода данных для обоих людей."
             )
             return
 
         # Получаем координаты, UTC и натальные карты для обоих
         name1, date1, time1, location1 = map(str.strip, person1_data)
-        latitude1, longitude1, tz_name1 = get_coordinates_and_timezone(location1)
+        latitude1, longitude1, tz_name1 = await get_coordinates_and_timezone_async(location1)
         utc_time1 = convert_to_utc(date1, time1, tz_name1)
-        hour_utc1 = utc_time1.hour + utc_time1.minute / 60.0
-        chart1 = calculate_chart(utc_time1.year, utc_time1.month, utc_time1.day, hour_utc1, latitude1, longitude1)
+        chart1 = await compute_chart_async(utc_time1, latitude1, longitude1)
 
         name2, date2, time2, location2 = map(str.strip, person2_data)
-        latitude2, longitude2, tz_name2 = get_coordinates_and_timezone(location2)
+        latitude2, longitude2, tz_name2 = await get_coordinates_and_timezone_async(location2)
         utc_time2 = convert_to_utc(date2, time2, tz_name2)
-        hour_utc2 = utc_time2.hour + utc_time2.minute / 60.0
-        chart2 = calculate_chart(utc_time2.year, utc_time2.month, utc_time2.day, hour_utc2, latitude2, longitude2)
+        chart2 = await compute_chart_async(utc_time2, latitude2, longitude2)
 
         # Анализ совместимости
-        compatibility_prompt = (
-            f"Ты астрологический эксперт. Сделай полный и подробный анализ совместимости на основе данных двух натальных карт. \n"
-            f"Данные первого человека:\nПланеты:\n{chart1}\n"
-            f"Данные второго человека:\nПланеты:\n{chart2}\n"
-            "Опиши совместимость, выделив сильные и слабые стороны взаимодействия. Описывай черты характера и сопоставляй их. Давай больше индивидуальной конкретики. Например: первый человек идеен и оптимистичен, второй предпочитает комфорт и бездятельность, это негативно влияет на совместимость."
+        compatibility_prompt = build_prompt(
+            "compatibility",
+            f"Первый человек.\n{encode_chart(chart1, houses=False)}\n"
+            f"Второй человек.\n{encode_chart(chart2, houses=False)}",
+            "gpt-4"
         )
-        compatibility_response = openai.ChatCompletion.create(
+        # Отправляем пользователю результат
+        await reply_with_completion(
+            update.message,
+            "Совместимость:\n\n",
             model="gpt-4",
-            messages=[{"role": "user", "content": compatibility_prompt}],
-            max_tokens=2000
+            prompt=compatibility_prompt,
+            flow="compatibility",
+            cache_ttl=CHART_CACHE_TTL
         )
-        compatibility_text = compatibility_response['choices'][0]['message']['content'].strip()
-
-        # Отправляем пользователю результат
-        await update.message.reply_text(f"Совместимость:\n\n{compatibility_text}")
     except Exception as e:
         logger.error(f"Ошибка расчета совместимости: {str(e)}")
-        await update.message.reply_text("Произошла ошибка при расчете совместимости.")
-
-from datetime import datetime
+        await sender.reply_text(update.message, "Произошла ошибка при расчете совместимости.")
 
 async def calculate_financial_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE, name: str, utc_time: datetime, latitude: float, longitude: float):
     try:
         # Используем текущую дату и время, если это необходимо
         current_time = datetime.utcnow()
 
-        # Часовой расчет времени
-        hour_utc = current_time.hour + current_time.minute / 60.0
-
-        # Расчет натальной карты
-        chart = calculate_chart(current_time.year, current_time.month, current_time.day, hour_utc, latitude, longitude)
-
-        # Расчет домов
-        houses, ascendant = calculate_houses(current_time.year, current_time.month, current_time.day, hour_utc, latitude, longitude)
+        # Расчет натальной карты и домов
+        natal_chart = await compute_chart_async(current_time, latitude, longitude)
+        chart = format_planets(natal_chart)
 
         # Формируем текстовый вывод
         chart_output = "\n".join([f"{key}: {value}" for key, value in chart.items()])
-        houses_output = "\n".join([f"{key}: {value}" for key, value in houses.items()])
 
         # Генерация интерпретации финансовой карты
-        prompt = (
-            f"Ты профессиональный финансовый астролог. Составь финансовую интерпретацию на основе натальной карты "
-            f"для {name}. Используй текущую дату ({current_time.strftime('%d.%m.%Y %H:%M UTC')}) и данные:\n"
-            f"Расположение планет:\n{chart_output}\n"
-            f"Дома:\n{houses_output}\nАсцендент: {ascendant}.\n"
-            f"Опиши основные сильные и слабые стороны финансового положения и дай рекомендации. Сохраняй структуру - сильные стороны, слабые стороны, рекомендации. Давай больше конкретных рекомендаций. Пиши текст как человек, четко обращаясь к клиенту"
-        )
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1500
+        prompt = build_prompt(
+            "financial",
+            f"Клиент: {name}. Дата: {current_time.strftime('%d.%m.%Y %H:%M UTC')}.\n{encode_chart(natal_chart)}",
+            "gpt-4"
         )
 
-        interpretation = response['choices'][0]['message']['content'].strip()
-
         # Отправка результата пользователю
-        await update.message.reply_text(
+        await reply_with_completion(
+            update.message,
             f"Финансовый расклад для {name}:\n\n"
             f"Планеты:\n{chart_output}\n\n"
             # f"Дома:\n{houses_output}\n\n"
             # f"Асцендент: {ascendant}\n\n"
-            f"\n{interpretation}"
+            f"\n",
+            model="gpt-4",
+            prompt=prompt,
+            flow="financial"
         )
 
     except Exception as e:
         logger.error(f"Ошибка финансового анализа: {e}")
-        await update.message.reply_text("Произошла ошибка при расчете финансового расклада. Проверьте данные.")
-
-
-# Основной запуск бота
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+        await sender.reply_text(update.message, "Произошла ошибка при расчете финансового расклада. Проверьте данные.")
+
+
+# Приложение с обработчиками, готовое к запуску. polling=False — без опроса,
+# обновления передаются в app.update_queue извне (рабочий процесс webhook_server)
+def prepare_application(polling=True):
+    # Эфемериды, полигоны часовых поясов и шрифты PDF загружаются в фоне, пока создаётся приложение,
+    # чтобы первый пользователь не ждал их загрузки
+    warm_up = start_warm_up(startup_report, [
+        ("эфемериды", chart_engine.astro_pool, chart_engine.warm_up),
+        ("часовые пояса", blocking_pool, warm_up_timezones),
+        ("геокодер", blocking_pool, get_geocoder),
+        ("шрифты PDF", blocking_pool, pdf_builder.warm_up),
+    ])
+
+    builder = Application.builder().token(BOT_TOKEN)
+    builder.concurrent_updates(UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    if TELEGRAM_BASE_URL:
+        builder.base_url(f"{TELEGRAM_BASE_URL}/bot")
+    if not polling:
+        builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    startup_report.mark("создание приложения")
+
+    wait_warm_up(startup_report, warm_up)
+    startup_report.log()
+    metrics.start_metrics_server(METRICS_PORT)
+    return app
+
+
+# Основной запуск бота: опрос в одном процессе или webhook с несколькими рабочими процессами
+def main():
+    if WEBHOOK_URL:
+        from webhook_server import run_webhook
+        run_webhook(WEBHOOK_URL, BOT_TOKEN, TELEGRAM_BASE_URL)
+        return
 
-    app.run_polling()
+    prepare_application().run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+from horoscope_renderer import FONT_PATH, HoroscopeRenderer
+
+ZODIAC_SIGNS = [
+    "Овен", "Телец", "Близнецы", "Рак",
+    "Лев", "Дева", "Весы", "Скорпион",
+    "Стрелец", "Козерог", "Водолей", "Рыбы"
+]
+
+SAMPLE_TEXT = (
+    "Сегодня звёзды советуют не торопиться с важными решениями и внимательно слушать близких. "
+    "Во второй половине дня возможны приятные новости, связанные с работой или учёбой. "
+    "Постарайтесь уделить время отдыху и не берите на себя лишних обязательств."
+) * 2
+
+
+# Прежняя реализация отрисовки: шрифты загружаются на каждый вызов,
+# строка измеряется целиком после добавления каждого слова
+def legacy_render(sign, text, font_path):
+    img_width, img_height = 1080, 1080
+    image = Image.new("RGB", (img_width, img_height), color=(255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    title_font = ImageFont.truetype(font_path, 70)
+    text_font = ImageFont.truetype(font_path, 40)
+
+    title_bbox = draw.textbbox((0, 0), sign, font=title_font)
+    draw.text(((img_width - (title_bbox[2] - title_bbox[0])) / 2, 50), sign, font=title_font, fill=(0, 0, 0))
+
+    lines = []
+    current_line = ""
+    for word in text.split():
+        test_line = f"{current_line} {word}".strip()
+        test_line_bbox = draw.textbbox((0, 0), test_line, font=text_font)
+        if test_line_bbox[2] - test_line_bbox[0] <= img_width - 100:
+            current_line = test_line
+        else:
+            lines.append(current_line)
+            current_line = word
+    lines.append(current_line)
+
+    y_offset = 170 + (img_height - 170 - len(lines) * 60) // 2
+    for line in lines:
+        line_bbox = draw.textbbox((0, 0), line, font=text_font)
+        draw.text(((img_width - (line_bbox[2] - line_bbox[0])) / 2, y_offset), line, font=text_font, fill=(0, 0, 0))
+        y_offset += 60
+    return image
+
+
+def _timeit(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+# Сравнение отрисовки всех 12 карточек (без сохранения на диск)
+def bench_render(font_path=FONT_PATH, repeat=5):
+    def legacy():
+        for sign in ZODIAC_SIGNS:
+            legacy_render(sign, SAMPLE_TEXT, font_path)
+
+    renderer = HoroscopeRenderer(font_path)
+
+    def cached():
+        for sign in ZODIAC_SIGNS:
+            renderer.render(sign, SAMPLE_TEXT)
+
+    legacy_time = _timeit(legacy, repeat)
+    cached_time = _timeit(cached, repeat)
+    print(f"12 карточек, прежняя отрисовка: {legacy_time * 1000:.1f} мс")
+    print(f"12 карточек, HoroscopeRenderer: {cached_time * 1000:.1f} мс ({legacy_time / cached_time:.1f}x)")
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# Нагрузочный тест: n запросов натальной карты одновременно.
+# Задержка считается от общего момента поступления. Каждый запрос ищет часовой пояс по координатам и считает карту на уникальный момент времени;
+# параллельно измеряется, насколько цикл событий опаздывает с тиками по 10 мс
+async def _chart_load(n, offload):
+    from timezonefinder import TimezoneFinder
+    import chart_engine
+    from workers import blocking_pool, run_in_pool
+
+    tf = TimezoneFinder()
+    chart_engine._compute_chart.cache_clear()
+    base_time = datetime(1990, 1, 1, 12, 0)
+
+    async def handler(i, arrived):
+        latitude, longitude = 40 + (i % 50) * 0.3, 30 + (i % 100) * 0.7
+        utc_time = base_time + timedelta(minutes=i * 37)
+        if offload:
+            await run_in_pool(blocking_pool, tf.timezone_at, lng=longitude, lat=latitude)
+            chart = await chart_engine.compute_chart_async(utc_time, latitude, longitude)
+        else:
+            tf.timezone_at(lng=longitude, lat=latitude)
+            chart = chart_engine.compute_chart(utc_time, latitude, longitude)
+        chart_engine.format_planets(chart)
+        chart_engine.format_houses(chart)
+        return time.perf_counter() - arrived
+
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    arrived = time.perf_counter()
+    latencies = await asyncio.gather(*(handler(i, arrived) for i in range(n)))
+    stop.set()
+    await ticker_task
+    return latencies, lags
+
+
+def bench_chart_load(n=50):
+    for offload in (False, True):
+        latencies, lags = asyncio.run(_chart_load(n, offload))
+        mode = "в пуле потоков" if offload else "в цикле событий"
+        print(
+            f"{n} карт {mode}: p50 {_percentile(latencies, 50) * 1000:.1f} мс, "
+            f"p99 {_percentile(latencies, 99) * 1000:.1f} мс, "
+            f"макс. задержка цикла {max(lags) * 1000:.1f} мс"
+        )
+
+
+# Пропускная способность сборки n PDF: прежний путь (шрифты регистрируются заново, файл на диске)
+# против PdfBuilder с общими шрифтами, собирающего документы в памяти в пуле потоков
+def bench_pdf(n=100, font_dir=None):
+    import os
+    import tempfile
+    import warnings
+    from pdf_builder import FONT_DIR, PdfBuilder
+    from workers import blocking_pool, run_in_pool
+
+    warnings.simplefilter("ignore")
+    font_dir = font_dir or FONT_DIR
+    chart = {f"Планета {i}": "Овен 12.34°" for i in range(10)}
+    houses = {f"Дом {i + 1}": "Телец 1.23°" for i in range(12)}
+    # У каждого документа свой набор символов: так проверяется, что сборки не портят друг другу шрифты
+    extra_glyphs = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789«»№§"
+    interpretations = [f"{SAMPLE_TEXT * 10} {extra_glyphs[i % len(extra_glyphs):]}" for i in range(n)]
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for interpretation in interpretations:
+            data = PdfBuilder(font_dir).build_natal_chart(chart, houses, "Лев 5.00°", interpretation)
+            with open(os.path.join(tmp_dir, "natal_chart.pdf"), "wb") as pdf_file:
+                pdf_file.write(data)
+    legacy_time = time.perf_counter() - started
+
+    builder = PdfBuilder(font_dir)
+    builder.warm_up()
+
+    async def build_all():
+        await asyncio.gather(*(
+            run_in_pool(blocking_pool, builder.build_natal_chart, chart, houses, "Лев 5.00°", interpretation)
+            for interpretation in interpretations
+        ))
+
+    started = time.perf_counter()
+    asyncio.run(build_all())
+    builder_time = time.perf_counter() - started
+
+    print(f"{n} PDF, прежний путь: {legacy_time:.2f} с ({n / legacy_time:.1f} PDF/с)")
+    print(f"{n} PDF, PdfBuilder: {builder_time:.2f} с ({n / builder_time:.1f} PDF/с)")
+
+
+# Положения планет на n моментов (например, почасовой скан транзитов): прежний путь по одному моменту
+# с форматированием строк против пакетного chart_batch с векторным переводом в знаки
+def bench_ephemeris(n=10000):
+    import swisseph as swe
+    import chart_batch
+    from chart_engine import EPHE_PATH, PLANETS, degree_to_sign
+
+    swe.set_ephe_path(EPHE_PATH)
+    times = [datetime(2000, 1, 1) + timedelta(hours=i) for i in range(n)]
+
+    started = time.perf_counter()
+    for utc_time in times:
+        julian_day = swe.julday(utc_time.year, utc_time.month, utc_time.day, utc_time.hour + utc_time.minute / 60.0)
+        {planet_name: degree_to_sign(swe.calc_ut(julian_day, planet_code)[0][0]) for planet_name, planet_code in PLANETS}
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    positions = chart_batch.planet_positions(chart_batch.julian_days(times))
+    chart_batch.split_longitudes(positions.longitudes)
+    batch_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chart_batch.planet_positions(chart_batch.julian_days(times), speeds=True)
+    speeds_time = time.perf_counter() - started
+
+    print(f"{n} моментов, по одному с форматированием: {legacy_time:.2f} с")
+    print(f"{n} моментов, chart_batch: {batch_time:.2f} с ({legacy_time / batch_time:.1f}x)")
+    print(f"{n} моментов, chart_batch со скоростями: {speeds_time:.2f} с")
+
+
+BENCHMARKS = {
+    "render": bench_render,
+    "chart_load": bench_chart_load,
+    "pdf": bench_pdf,
+    "ephemeris": bench_ephemeris,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--font", default=FONT_PATH, help="Путь к шрифту TTF")
+    parser.add_argument("--fonts-dir", default=None, help="Папка со шрифтами DejaVu для PDF")
+    parser.add_argument("-n", type=int, default=None, help="Число одновременных запросов (для ephemeris — моментов)")
+    args = parser.parse_args()
+
+    if args.benchmark == "render":
+        bench_render(args.font)
+    elif args.benchmark == "chart_load":
+        bench_chart_load(args.n or 50)
+    elif args.benchmark == "pdf":
+        bench_pdf(args.n or 100, args.fonts_dir)
+    elif args.benchmark == "ephemeris":
+        bench_ephemeris(args.n or 10000)
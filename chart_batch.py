@@ -0,0 +1,70 @@
+from collections import namedtuple
+
+import numpy as np
+import swisseph as swe
+
+from chart_engine import PLANETS, SIGNS, astro_pool
+from workers import run_in_pool
+
+# Юлианский день начала эпохи Unix (1970-01-01 00:00 UTC)
+UNIX_EPOCH_JD = 2440587.5
+SECONDS_PER_DAY = 86400.0
+
+# Положения планет для массива моментов: longitudes и speeds — массивы (моменты × планеты),
+# speeds равен None, если скорости не запрашивались
+PlanetPositions = namedtuple("PlanetPositions", ["julian_days", "planets", "longitudes", "speeds"])
+
+
+# Юлианские дни для последовательности моментов UTC (datetime без часового пояса или datetime64)
+def julian_days(utc_times):
+    times = np.asarray(utc_times, dtype="datetime64[ms]")
+    seconds = (times - np.datetime64(0, "ms")).astype(np.float64) / 1000.0
+    return seconds / SECONDS_PER_DAY + UNIX_EPOCH_JD
+
+
+# Долготы (и при speeds=True — скорости) планет для массива юлианских дней.
+# Внешний цикл идёт по планетам: Swiss Ephemeris держит в кэше участок файла эфемерид текущей планеты
+def planet_positions(julian_days, planets=PLANETS, speeds=False):
+    julian_days = np.ascontiguousarray(julian_days, dtype=np.float64).ravel()
+    longitudes = np.empty((len(julian_days), len(planets)))
+    planet_speeds = np.empty_like(longitudes) if speeds else None
+    flags = swe.FLG_SWIEPH | swe.FLG_SPEED if speeds else swe.FLG_SWIEPH
+    calc_ut = swe.calc_ut
+    days = julian_days.tolist()
+
+    for column, (_, planet_code) in enumerate(planets):
+        for row, julian_day in enumerate(days):
+            position = calc_ut(julian_day, planet_code, flags)[0]
+            longitudes[row, column] = position[0]
+            if speeds:
+                planet_speeds[row, column] = position[3]
+
+    names = tuple(planet_name for planet_name, _ in planets)
+    return PlanetPositions(julian_days, names, longitudes, planet_speeds)
+
+
+# Асинхронная версия: расчёт выполняется в пуле астрономических расчётов
+async def planet_positions_async(julian_days, planets=PLANETS, speeds=False):
+    return await run_in_pool(astro_pool, planet_positions, julian_days, planets, speeds)
+
+
+# Номер знака (0 — Овен) и градус внутри знака для массива долгот
+def split_longitudes(longitudes):
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    sign_indexes = (np.mod(longitudes, 360.0) // 30).astype(np.int8)
+    return sign_indexes, np.mod(longitudes, 30.0)
+
+
+# Строки вида "Овен 12.34°" для одного момента, в формате format_planets
+def format_row(positions, row):
+    sign_indexes, degrees = split_longitudes(positions.longitudes[row])
+    return {
+        planet_name: f"{SIGNS[sign_index]} {degree:.2f}°"
+        for planet_name, sign_index, degree in zip(positions.planets, sign_indexes.tolist(), degrees.tolist())
+    }
+
+
+# Строки формируются только для тех моментов, до которых дошёл перебор
+def iter_formatted(positions):
+    for row in range(len(positions.julian_days)):
+        yield format_row(positions, row)
@@ -0,0 +1,101 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import swisseph as swe
+
+import metrics
+from workers import run_in_pool
+
+SIGNS = [
+    "Овен", "Телец", "Близнецы", "Рак",
+    "Лев", "Дева", "Весы", "Скорпион",
+    "Стрелец", "Козерог", "Водолей", "Рыбы"
+]
+
+PLANETS = (
+    ("Солнце", swe.SUN),
+    ("Луна", swe.MOON),
+    ("Меркурий", swe.MERCURY),
+    ("Венера", swe.VENUS),
+    ("Марс", swe.MARS),
+    ("Юпитер", swe.JUPITER),
+    ("Сатурн", swe.SATURN),
+    ("Уран", swe.URANUS),
+    ("Нептун", swe.NEPTUNE),
+    ("Плутон", swe.PLUTO),
+)
+
+# Путь к файлам эфемерид
+EPHE_PATH = './ephemeris'
+
+# Swiss Ephemeris хранит состояние в глобальных переменных и не потокобезопасна,
+# поэтому асинхронные расчёты идут в одном выделенном потоке
+ASTRO_WORKERS = 1
+
+# Сколько карт хранится в кэше и до скольких знаков округляются координаты (~100 м)
+CHART_CACHE_SIZE = 4096
+COORD_PRECISION = 3
+
+swe.set_ephe_path(EPHE_PATH)
+astro_pool = ThreadPoolExecutor(
+    max_workers=ASTRO_WORKERS,
+    thread_name_prefix="astro",
+    initializer=swe.set_ephe_path,
+    initargs=(EPHE_PATH,)
+)
+
+# Натальная карта в градусах: planets — пары (планета, долгота), cusps — границы домов
+NatalChart = namedtuple("NatalChart", ["planets", "cusps", "ascendant"])
+
+
+# Преобразование градуса в знак зодиака
+def degree_to_sign(degree):
+    sign_index = int(degree // 30)
+    degree_in_sign = degree % 30
+    return f"{SIGNS[sign_index]} {degree_in_sign:.2f}°"
+
+
+# Планеты и дома считаются по одному юлианскому дню
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def _compute_chart(year, month, day, hour, minute, latitude, longitude):
+    with metrics.span("ephemeris"):
+        julian_day = swe.julday(year, month, day, hour + minute / 60.0)
+        planets = tuple((planet_name, swe.calc_ut(julian_day, planet_code)[0][0]) for planet_name, planet_code in PLANETS)
+        house_cusps, ascmc = swe.houses(julian_day, latitude, longitude, b'P')  # Система домов Плацидуса
+    return NatalChart(planets, tuple(house_cusps), ascmc[0])
+
+
+# Карта на момент utc_time (с точностью до минуты); повторные запросы берутся из кэша
+def compute_chart(utc_time, latitude, longitude):
+    return _compute_chart(
+        utc_time.year, utc_time.month, utc_time.day, utc_time.hour, utc_time.minute,
+        round(latitude, COORD_PRECISION), round(longitude, COORD_PRECISION)
+    )
+
+
+# Асинхронная версия: расчёт выполняется в пуле астрономических расчётов
+async def compute_chart_async(utc_time, latitude, longitude):
+    return await run_in_pool(astro_pool, compute_chart, utc_time, latitude, longitude)
+
+
+def format_planets(chart):
+    return {planet_name: degree_to_sign(degree) for planet_name, degree in chart.planets}
+
+
+def format_houses(chart):
+    houses = {f"Дом {i+1}": degree_to_sign(cusp) for i, cusp in enumerate(chart.cusps)}
+    return houses, degree_to_sign(chart.ascendant)
+
+
+# Пробный расчёт: Swiss Ephemeris открывает файлы эфемерид при первом обращении к планете.
+# Вызывается в потоке astro_pool, где потом идут все расчёты
+def warm_up():
+    julian_day = swe.julday(2000, 1, 1, 12.0)
+    for _, planet_code in PLANETS:
+        swe.calc_ut(julian_day, planet_code)
+    swe.houses(julian_day, 55.75, 37.62, b'P')
+
+
+def chart_cache_info():
+    return _compute_chart.cache_info()
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Файл базы кэша ответов и ограничения размера
+COMPLETION_CACHE_PATH = "./completion_cache.sqlite3"
+MAX_ENTRIES = 5000
+MEMORY_CACHE_SIZE = 256
+# Время последнего использования записывается в базу пачками: при записи ответа
+# или после стольких попаданий (потеря несохранённых отметок влияет только на порядок вытеснения)
+TOUCH_BATCH_SIZE = 100
+
+
+# Ключ по содержимому запроса: одинаковые (model, messages, max_tokens) дают одинаковый ключ
+def completion_key(model, messages, max_tokens=None):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Кэш ответов модели: LRU в памяти поверх SQLite, у каждой записи свой срок жизни
+class CompletionCache:
+    def __init__(self, db_path=COMPLETION_CACHE_PATH, max_entries=MAX_ENTRIES, memory_size=MEMORY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._db.commit()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            value = self._memory.get(key)
+            if value is None:
+                row = self._db.execute("SELECT content, expires FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = tuple(row)
+            if value is None or value[1] <= now:
+                metrics.increment("completion_cache", result="miss")
+                return None
+
+            metrics.increment("completion_cache", result="hit")
+            self._remember(key, value)
+            self._touched[key] = now
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._flush_touched()
+                self._db.commit()
+            return value[0]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE completions SET last_used = ? WHERE key = ?", [(now, key) for key, now in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def put(self, key, content, ttl):
+        now = time.time()
+        value = (content, now + ttl)
+        with self._lock:
+            self._flush_touched()
+            self._touched.pop(key, None)
+            self._db.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, content, value[1], now))
+            self._remember(key, value)
+            self._evict(now)
+            self._db.commit()
+
+    # Удаление просроченных записей и самых давно использованных сверх лимита
+    def _evict(self, now):
+        self._db.execute("DELETE FROM completions WHERE expires <= ?", (now,))
+        count = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            self._memory.clear()
@@ -0,0 +1,92 @@
+import csv
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Файл базы кэша и встроенный список городов
+GEO_CACHE_PATH = "./geo_cache.sqlite3"
+CITIES_PATH = "./cities.csv"
+MEMORY_CACHE_SIZE = 1024
+
+
+# Нормализация названия города: "  г. Санкт-Петербург " и "санкт-петербург" дают один ключ
+def normalize_city(name):
+    key = " ".join(name.replace("ё", "е").replace("Ё", "Е").casefold().split())
+    for prefix in ("г. ", "г.", "город "):
+        if key.startswith(prefix):
+            key = key[len(prefix):].strip()
+            break
+    return key
+
+
+# Кэш "город -> (широта, долгота, часовой пояс)": LRU в памяти поверх SQLite на диске
+class GeoCache:
+    def __init__(self, db_path=GEO_CACHE_PATH, max_size=MEMORY_CACHE_SIZE):
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS geocache ("
+            "key TEXT PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL, timezone TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    # Поиск только в памяти, без обращения к диску
+    def peek(self, name):
+        key = normalize_city(name)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            return value
+
+    def get(self, name):
+        key = normalize_city(name)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+            row = self._db.execute(
+                "SELECT latitude, longitude, timezone FROM geocache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value = tuple(row)
+            self._remember(key, value)
+            return value
+
+    def put(self, name, latitude, longitude, tz_name):
+        key = normalize_city(name)
+        value = (latitude, longitude, tz_name)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO geocache VALUES (?, ?, ?, ?)", (key, *value))
+            self._db.commit()
+            self._remember(key, value)
+
+    # Значение из кэша или из fetch(name) с сохранением результата
+    def resolve(self, name, fetch):
+        value = self.get(name)
+        if value is None:
+            value = tuple(fetch(name))
+            self.put(name, *value)
+        return value
+
+    # Предзаполнение из CSV (name,latitude,longitude,timezone); существующие записи не перезаписываются
+    def seed_from_csv(self, path=CITIES_PATH):
+        with open(path, encoding="utf-8", newline="") as cities_file:
+            rows = [
+                (normalize_city(row["name"]), float(row["latitude"]), float(row["longitude"]), row["timezone"])
+                for row in csv.DictReader(cities_file)
+            ]
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO geocache VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+        return len(rows)
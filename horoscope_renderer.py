@@ -0,0 +1,142 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Параметры оформления карточки гороскопа
+FONT_PATH = "/System/Library/Fonts/Supplemental/Arial.ttf"  # Проверьте путь шрифта
+BACKGROUND_COLOR = (255, 255, 255)  # Белый фон
+TEXT_COLOR = (0, 0, 0)  # Чёрный текст
+TITLE_FONT_SIZE = 70  # Увеличенный шрифт для заголовка
+TEXT_FONT_SIZE = 40  # Обычный шрифт для текста
+LINE_SPACING = 20  # Межстрочный интервал
+TITLE_Y = 50  # Отступ сверху для заголовка
+SIDE_MARGIN = 50  # Отступ текста от краёв
+
+
+# Шрифт с кэшем ширины символов
+class MeasuredFont:
+    def __init__(self, font_path, size):
+        # Базовая раскладка быстрее Raqm и достаточна для кириллицы
+        self.font = ImageFont.truetype(font_path, size, layout_engine=ImageFont.Layout.BASIC)
+        self.size = size
+        self._advances = {}
+
+    def advance(self, char):
+        width = self._advances.get(char)
+        if width is None:
+            width = self.font.getlength(char)
+            self._advances[char] = width
+        return width
+
+    def measure(self, text):
+        return sum(self.advance(char) for char in text)
+
+
+# Рендерер карточек: шрифты загружаются один раз и переиспользуются
+class HoroscopeRenderer:
+    def __init__(self, font_path=FONT_PATH, title_font_size=TITLE_FONT_SIZE, text_font_size=TEXT_FONT_SIZE):
+        self.title_font = MeasuredFont(font_path, title_font_size)
+        self.text_font = MeasuredFont(font_path, text_font_size)
+
+    # Разбиение текста на строки за один проход по словам
+    def wrap(self, text, max_width):
+        font = self.text_font
+        space_width = font.advance(" ")
+        lines = []
+        current_words = []
+        current_width = 0
+
+        for word in text.split():
+            word_width = font.measure(word)
+            if current_words and current_width + space_width + word_width > max_width:
+                lines.append((" ".join(current_words), current_width))
+                current_words = [word]
+                current_width = word_width
+            elif current_words:
+                current_words.append(word)
+                current_width += space_width + word_width
+            else:
+                current_words = [word]
+                current_width = word_width
+        lines.append((" ".join(current_words), current_width))
+        return lines
+
+    def render(self, sign, text, size=(1080, 1080)):
+        img_width, img_height = size
+        image = Image.new("RGB", (img_width, img_height), color=BACKGROUND_COLOR)
+        draw = ImageDraw.Draw(image)
+
+        # Рисуем заголовок
+        title_width = self.title_font.measure(sign)
+        draw.text(((img_width - title_width) / 2, TITLE_Y), sign, font=self.title_font.font, fill=TEXT_COLOR)
+
+        # Центрирование текста ниже заголовка
+        lines = self.wrap(text, img_width - 2 * SIDE_MARGIN)
+        line_height = self.text_font.size + LINE_SPACING
+        text_y_start = TITLE_Y + self.title_font.size + 50  # Отступ после заголовка
+        total_text_height = len(lines) * line_height
+        y_offset = text_y_start + (img_height - text_y_start - total_text_height) // 2
+
+        for line, line_width in lines:
+            draw.text(((img_width - line_width) / 2, y_offset), line, font=self.text_font.font, fill=TEXT_COLOR)
+            y_offset += line_height
+
+        return image
+
+
+# Варианты карточек: квадрат для ленты и вертикаль для сторис
+IMAGE_VARIANTS = {
+    "square": (1080, 1080),
+    "story": (1080, 1920),
+}
+
+# Рендерер рабочего процесса (создаётся один раз на процесс)
+_worker_renderer = None
+
+
+def _init_worker(font_path):
+    global _worker_renderer
+    _worker_renderer = HoroscopeRenderer(font_path)
+
+
+def variant_path(output_dir, sign, variant):
+    if variant == "square":
+        return os.path.join(output_dir, f"{sign}.jpg")
+    return os.path.join(output_dir, f"{sign}_{variant}.jpg")
+
+
+# Кодирование изображения в JPEG в памяти
+def encode_image(image, image_format="JPEG"):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+# Отрисовка всех вариантов одной карточки внутри рабочего процесса.
+# Возвращает закодированные байты; при указании output_dir они дополнительно сохраняются на диск
+def render_job(sign, text, output_dir=None, variants=("square",)):
+    global _worker_renderer
+    if _worker_renderer is None:
+        _worker_renderer = HoroscopeRenderer()
+
+    images = {}
+    for variant in variants:
+        image = _worker_renderer.render(sign, text, IMAGE_VARIANTS[variant])
+        data = encode_image(image)
+        if output_dir:
+            with open(variant_path(output_dir, sign, variant), "wb") as image_file:
+                image_file.write(data)
+        images[variant] = data
+    return images
+
+
+# Пул процессов по числу ядер
+def create_render_pool(max_workers=None, font_path=FONT_PATH):
+    return ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(font_path,)
+    )
+
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+
+import openai
+
+import metrics
+from completion_cache import CompletionCache, completion_key
+
+logger = logging.getLogger(__name__)
+
+# Ограничение одновременных запросов к каждой модели
+MODEL_CONCURRENCY = {
+    "gpt-4": 4,
+    "gpt-3.5-turbo": 8,
+}
+DEFAULT_CONCURRENCY = 4
+
+# Таймаут одного запроса (в секундах)
+REQUEST_TIMEOUT = 90
+
+# Кэш ответов создаётся при первом обращении
+_cache = None
+
+# Семафоры привязаны к циклу событий, поэтому храним их отдельно для каждого цикла
+_semaphores = {}
+_semaphores_loop = None
+
+
+def _get_semaphore(model):
+    global _semaphores, _semaphores_loop
+    loop = asyncio.get_running_loop()
+    if loop is not _semaphores_loop:
+        _semaphores = {}
+        _semaphores_loop = loop
+    if model not in _semaphores:
+        limit = MODEL_CONCURRENCY.get(model, DEFAULT_CONCURRENCY)
+        _semaphores[model] = asyncio.Semaphore(limit)
+    return _semaphores[model]
+
+
+def _record_usage(model, flow, prompt_tokens, completion_tokens):
+    if flow:
+        metrics.record_tokens(model, prompt_tokens, completion_tokens, flow=flow)
+        logger.info(f"Токены {flow} ({model}): запрос {prompt_tokens}, ответ {completion_tokens}")
+    else:
+        metrics.record_tokens(model, prompt_tokens, completion_tokens)
+
+
+# Лимит параллельных запросов к модели не ниже limit (например, для пакета гороскопов).
+# Новый семафор создаётся при следующем запросе
+def ensure_model_concurrency(model, limit):
+    if limit > MODEL_CONCURRENCY.get(model, DEFAULT_CONCURRENCY):
+        MODEL_CONCURRENCY[model] = limit
+        _semaphores.pop(model, None)
+
+
+# Асинхронный запрос к OpenAI с ограничением параллельности и таймаутом.
+# flow — сценарий, по которому раздельно учитываются токены запроса и ответа
+async def chat_completion(model, messages, max_tokens=None, timeout=REQUEST_TIMEOUT, flow=None, **kwargs):
+    params = {"model": model, "messages": messages, **kwargs}
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+
+    async with _get_semaphore(model):
+        with metrics.span("llm", model=model):
+            response = await asyncio.wait_for(
+                openai.ChatCompletion.acreate(request_timeout=timeout, **params),
+                timeout=timeout,
+            )
+    usage = response.get('usage') or {}
+    _record_usage(model, flow, usage.get('prompt_tokens'), usage.get('completion_tokens'))
+    return response
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = CompletionCache()
+    return _cache
+
+
+# Готовый ответ из кэша или None
+def cached_completion(model, messages, max_tokens=None):
+    return get_cache().get(completion_key(model, messages, max_tokens))
+
+
+def store_completion(model, messages, max_tokens, content, ttl):
+    get_cache().put(completion_key(model, messages, max_tokens), content, ttl)
+
+
+# Возвращает только текст ответа.
+# cache_ttl (в секундах) включает кэш для мест, где разнообразие ответов не важно
+async def complete(model, messages, max_tokens=None, timeout=REQUEST_TIMEOUT, cache_ttl=None, flow=None, **kwargs):
+    if cache_ttl:
+        cached = cached_completion(model, messages, max_tokens)
+        if cached is not None:
+            return cached
+
+    response = await chat_completion(model, messages, max_tokens=max_tokens, timeout=timeout, flow=flow, **kwargs)
+    content = response['choices'][0]['message']['content'].strip()
+    if cache_ttl and content:
+        store_completion(model, messages, max_tokens, content, cache_ttl)
+    return content
+
+
+# Потоковый ответ: отдаёт текст по частям по мере генерации.
+# timeout ограничивает ожидание каждой следующей части.
+# В потоке OpenAI не сообщает расход токенов; каждая часть — один токен ответа,
+# а размер запроса передаётся в prompt_tokens (подсчитанный локально)
+async def stream_completion(model, messages, max_tokens=None, timeout=REQUEST_TIMEOUT, flow=None, prompt_tokens=None,
+                            **kwargs):
+    params = {"model": model, "messages": messages, "stream": True, **kwargs}
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+
+    async with _get_semaphore(model):
+        started = time.perf_counter()
+        chunks = 0
+        with metrics.span("llm_stream", model=model):
+            stream = await asyncio.wait_for(
+                openai.ChatCompletion.acreate(request_timeout=timeout, **params),
+                timeout=timeout,
+            )
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=timeout)
+                except StopAsyncIteration:
+                    break
+                content = chunk['choices'][0]['delta'].get('content')
+                if content:
+                    if not chunks:
+                        metrics.observe("llm_first_token", time.perf_counter() - started, model=model)
+                    chunks += 1
+                    yield content
+        _record_usage(model, flow, prompt_tokens, chunks)
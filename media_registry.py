@@ -0,0 +1,71 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Файл реестра загруженных в Telegram файлов
+MEDIA_REGISTRY_PATH = "./media_registry.sqlite3"
+
+
+# Ключ файла: путь, размер и время изменения — изменённый файл загрузится заново
+def media_key(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# Реестр file_id: файл загружается в Telegram один раз, дальше отправляется по file_id
+class MediaRegistry:
+    def __init__(self, db_path=MEDIA_REGISTRY_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media (key TEXT PRIMARY KEY, file_id TEXT NOT NULL, uploaded REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT file_id FROM media WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, file_id):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?)", (key, file_id, time.time()))
+            self._db.commit()
+
+    def forget(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM media WHERE key = ?", (key,))
+            self._db.commit()
+
+    # send — метод TelegramSender (send_photo / send_document), extract — file_id из ответа
+    async def _send(self, send, extract, chat_id, path, **kwargs):
+        key = media_key(path)
+        file_id = self.get(key)
+        if file_id:
+            try:
+                return await send(chat_id, file_id, **kwargs)
+            except BadRequest as e:
+                # Ошибки, не связанные с file_id (например, длинная подпись), пробрасываем
+                if "file" not in str(e).lower():
+                    raise
+                # file_id больше не действует — загружаем файл заново
+                logger.warning(f"Устаревший file_id для {path}: {e}")
+                self.forget(key)
+
+        with open(path, "rb") as media_file:
+            data = media_file.read()
+        message = await send(chat_id, data, **kwargs)
+        self.put(key, extract(message))
+        return message
+
+    async def send_photo(self, sender, chat_id, path, **kwargs):
+        return await self._send(sender.send_photo, lambda message: message.photo[-1].file_id, chat_id, path, **kwargs)
+
+    async def send_document(self, sender, chat_id, path, **kwargs):
+        return await self._send(sender.send_document, lambda message: message.document.file_id, chat_id, path, **kwargs)
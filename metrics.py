@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности этапов (в секундах)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Сколько последних замеров каждого этапа хранится для p50/p99 в сводке
+RESERVOIR_SIZE = 1024
+METRICS_PREFIX = "horoscope"
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _percentile(ordered, percent):
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": round(_percentile(ordered, 50), 4),
+            "p90": round(_percentile(ordered, 90), 4),
+            "p99": round(_percentile(ordered, 99), 4),
+            "max": round(ordered[-1], 4),
+        }
+
+
+# Длительности этапов (гистограммы) и счётчики (токены, ошибки) с метками
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    # Текстовый формат Prometheus
+    def render(self):
+        lines = [f"# TYPE {METRICS_PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            for (stage, labels), histogram in sorted(self._histograms.items()):
+                labels = (("stage", stage),) + labels
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{METRICS_PREFIX}_stage_seconds_bucket{_label_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{METRICS_PREFIX}_stage_seconds_bucket{_label_text(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{METRICS_PREFIX}_stage_seconds_sum{_label_text(labels)} {histogram.sum}")
+                lines.append(f"{METRICS_PREFIX}_stage_seconds_count{_label_text(labels)} {histogram.count}")
+
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{METRICS_PREFIX}_{name}_total{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # Сводка для JSON: p50/p90/p99 по этапам и значения счётчиков
+    def summary(self):
+        with self._lock:
+            stages = {
+                stage + _label_text(labels): histogram.summary()
+                for (stage, labels), histogram in sorted(self._histograms.items())
+            }
+            counters = {
+                name + _label_text(labels): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+        return {"stages": stages, "counters": counters}
+
+
+# Общий реестр процесса и реестры активных запусков (сводка одного запуска ежедневной задачи)
+REGISTRY = Registry()
+_run_registries = []
+
+
+def observe(stage, seconds, **labels):
+    REGISTRY.observe(stage, seconds, **labels)
+    for registry in list(_run_registries):
+        registry.observe(stage, seconds, **labels)
+
+
+def increment(name, value=1, **labels):
+    REGISTRY.increment(name, value, **labels)
+    for registry in list(_run_registries):
+        registry.increment(name, value, **labels)
+
+
+# Замер этапа: with span("pdf"): ... Ошибки считаются отдельно и пробрасываются дальше
+@contextmanager
+def span(stage, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment("stage_errors", stage=stage, **labels)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, **labels)
+
+
+# Токены одного запроса к модели; labels — например, сценарий flow
+def record_tokens(model, prompt_tokens=None, completion_tokens=None, **labels):
+    if prompt_tokens:
+        increment("llm_tokens", prompt_tokens, model=model, kind="prompt", **labels)
+    if completion_tokens:
+        increment("llm_tokens", completion_tokens, model=model, kind="completion", **labels)
+
+
+# Сводка одного запуска в JSON: в файл попадают только этапы, выполненные внутри блока.
+# Без summary_dir блок ничего не записывает
+@contextmanager
+def run_summary(name, summary_dir=None):
+    if not summary_dir:
+        yield
+        return
+
+    registry = Registry()
+    _run_registries.append(registry)
+    started_at = datetime.now()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _run_registries.remove(registry)
+        summary = {
+            "run": name,
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "duration": round(time.perf_counter() - started, 3),
+            **registry.summary(),
+        }
+        os.makedirs(summary_dir, exist_ok=True)
+        path = os.path.join(summary_dir, f"{name}-{started_at:%Y%m%d-%H%M%S}.json")
+        with open(path, "w", encoding="utf-8") as summary_file:
+            json.dump(summary, summary_file, ensure_ascii=False, indent=2)
+        logger.info(f"Сводка запуска {name} сохранена: {path}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# HTTP-эндпоинт /metrics в фоновом потоке; port=0 или None — не запускать
+def start_metrics_server(port, host="127.0.0.1"):
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
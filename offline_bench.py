@@ -0,0 +1,398 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import metrics
+from benchmarks import _percentile
+from stub_backends import StubConfig, StubOpenAI, StubTelegram
+
+# Каталог репозитория: отсюда берутся список городов, шрифты и эфемериды для рабочего каталога прогона
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STUB_TOKEN = "123456:stub"
+BENCH_CHANNEL_ID = "@bench_channel"
+CITIES = ("Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань", "Самара")
+
+
+# Чистый рабочий каталог: кэши ответов, геокодирования и file_id каждый прогон начинаются пустыми,
+# поэтому результаты сравнимы между коммитами
+def prepare_workdir(fonts_dir=None):
+    workdir = tempfile.mkdtemp(prefix="horoscope_bench_")
+    shutil.copy(os.path.join(REPO_DIR, "cities.csv"), workdir)
+    for name, source in (("fonts", fonts_dir or os.path.join(REPO_DIR, "fonts")),
+                         ("ephemeris", os.path.join(REPO_DIR, "ephemeris"))):
+        if os.path.isdir(source):
+            os.symlink(os.path.abspath(source), os.path.join(workdir, name))
+    os.chdir(workdir)
+    return workdir
+
+
+def _peak_memory_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(own / scale, 1), round(children / scale, 1)
+
+
+def _latency_stats(latencies):
+    return {
+        "p50": round(_percentile(latencies, 50), 3),
+        "p90": round(_percentile(latencies, 90), 3),
+        "p99": round(_percentile(latencies, 99), 3),
+        "max": round(max(latencies), 3),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Ежедневный пост целиком: генерация, отрисовка, отправка гороскопов и карты дня; runs прогонов подряд
+async def scenario_daily_post(telegram_url, runs=3, font_path=None):
+    from PIL import Image
+    from telegram import Bot
+    import Horoscope
+    from horoscope_renderer import create_render_pool
+    from telegram_sender import TelegramSender
+
+    card_path = os.path.abspath("card.jpg")
+    Image.new("RGB", (600, 1000), color=(40, 20, 80)).save(card_path)
+    Horoscope.TARO_CARDS = [{"name": "Шут", "image": card_path}]
+    Horoscope.CHANNEL_ID = BENCH_CHANNEL_ID
+    if font_path:
+        Horoscope.create_render_pool = functools.partial(create_render_pool, font_path=font_path)
+
+    latencies = []
+    async with Bot(token=STUB_TOKEN, base_url=f"{telegram_url}/bot") as bot:
+        for _ in range(runs):
+            # Новый sender на каждый прогон: в жизни посты разделены сутками и не упираются в лимит канала
+            sender = TelegramSender(bot)
+            started = time.perf_counter()
+            await Horoscope.main(sender)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _update(bot, update_id, text):
+    from telegram import Update
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": f"Пользователь {update_id}"},
+            "text": text,
+        },
+    }, bot)
+
+
+# Одновременные обращения к Starbutts: каждый пользователь — отдельный чат, handle_message вызывается
+# как при опросе, время ответа — от поступления до последнего запроса бота в этот чат
+async def _starbutts_burst(telegram, telegram_url, requests):
+    from types import SimpleNamespace
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    import Starbutts
+
+    # Пул соединений как у Application.builder() по умолчанию (у голого Bot — одно соединение)
+    request = HTTPXRequest(connection_pool_size=256)
+    async with Bot(token=STUB_TOKEN, base_url=f"{telegram_url}/bot", request=request) as bot:
+        updates = []
+        for user_id, text, state in requests:
+            await Starbutts.state_store.save(user_id, state)
+            updates.append((_update(bot, user_id, text), SimpleNamespace(user_data={})))
+        arrived = time.perf_counter()
+        for update, context in updates:
+            await Starbutts.handle_message(update, context)
+        while Starbutts.request_queue.stats()["in_flight"]:
+            await asyncio.sleep(0.05)
+        finished = time.perf_counter()
+
+    latencies = [telegram.last_request[user_id] - arrived for user_id, _, _ in requests if user_id in telegram.last_request]
+    return latencies, finished - arrived
+
+
+def _birth_data(i):
+    return f"Пользователь {i}, {1 + i % 28:02d}.{1 + i % 12:02d}.{1960 + i % 40}, {i % 24:02d}:{i % 60:02d}, {CITIES[i % len(CITIES)]}"
+
+
+async def scenario_natal_charts(telegram, telegram_url, n=100):
+    requests = [(i + 1, _birth_data(i), {"awaiting_data": "individual"}) for i in range(n)]
+    return await _starbutts_burst(telegram, telegram_url, requests)
+
+
+async def scenario_compatibility(telegram, telegram_url, n=50):
+    requests = [
+        (i + 1, _birth_data(i + 1000), {"awaiting_data": "person2", "person1_data": _birth_data(i)})
+        for i in range(n)
+    ]
+    return await _starbutts_burst(telegram, telegram_url, requests)
+
+
+def run_scenario(args):
+    import openai
+
+    prepare_workdir(args.fonts_dir)
+    openai_stub = StubOpenAI(StubConfig(
+        latency=args.llm_latency, error_rate=args.llm_error_rate,
+        tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens, seed=args.seed
+    )).start()
+    telegram_stub = StubTelegram(StubConfig(
+        latency=args.telegram_latency, error_rate=args.telegram_error_rate,
+        flood_rate=args.flood_rate, seed=args.seed
+    )).start()
+    openai.api_base = f"{openai_stub.url}/v1"
+    openai.api_key = "stub"
+
+    started = time.perf_counter()
+    if args.scenario == "daily_post":
+        latencies = asyncio.run(scenario_daily_post(telegram_stub.url, args.n or 3, args.font))
+        wall_time = time.perf_counter() - started
+        completed = len(latencies)
+    else:
+        scenario = scenario_natal_charts if args.scenario == "natal_charts" else scenario_compatibility
+        latencies, wall_time = asyncio.run(scenario(telegram_stub, telegram_stub.url, args.n or (100 if args.scenario == "natal_charts" else 50)))
+        completed = len(latencies)
+
+    own_memory, children_memory = _peak_memory_mb()
+    result = {
+        "scenario": args.scenario,
+        "commit": _git_commit(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+        "completed": completed,
+        "wall_time": round(wall_time, 3),
+        "throughput": round(completed / wall_time, 2) if wall_time else 0.0,
+        "latency": _latency_stats(latencies) if latencies else None,
+        "peak_memory_mb": own_memory,
+        "peak_children_memory_mb": children_memory,
+        "openai_requests": dict(openai_stub.requests),
+        "telegram_requests": dict(telegram_stub.requests),
+        "injected_errors": {"openai": openai_stub.errors, "telegram": telegram_stub.errors},
+        "stages": metrics.REGISTRY.summary()["stages"],
+    }
+    openai_stub.stop()
+    telegram_stub.stop()
+    return result
+
+
+def print_result(result, baseline=None):
+    latency = result["latency"] or {}
+    print(f"Сценарий {result['scenario']} (коммит {result['commit']}):")
+    print(f"  выполнено: {result['completed']} за {result['wall_time']:.2f} с, {result['throughput']:.2f} в секунду")
+    if latency:
+        print(f"  время ответа: p50 {latency['p50']:.2f} с, p90 {latency['p90']:.2f} с, "
+              f"p99 {latency['p99']:.2f} с, макс. {latency['max']:.2f} с")
+    print(f"  пик памяти: {result['peak_memory_mb']} МБ (дочерние процессы {result['peak_children_memory_mb']} МБ)")
+    print(f"  запросы OpenAI: {result['openai_requests']}, Telegram: {result['telegram_requests']}")
+    print(f"  внесённые ошибки: {result['injected_errors']}")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage}: n={stats['count']}, p50 {stats['p50'] * 1000:.1f} мс, p99 {stats['p99'] * 1000:.1f} мс")
+
+    if baseline:
+        print(f"Сравнение с {baseline['commit']}:")
+        for name, key in (("пропускная способность", "throughput"), ("пик памяти", "peak_memory_mb")):
+            print(f"  {name}: {baseline[key]} -> {result[key]}")
+        if baseline["latency"] and latency:
+            for key in ("p50", "p99"):
+                print(f"  {key}: {baseline['latency'][key]} -> {latency[key]} с")
+
+
+# Фронтальный процесс режима webhook. Логи фронта и рабочих процессов пишутся в файл рабочего каталога
+def _webhook_front(port, workers, env):
+    import logging
+    from webhook_server import run_webhook
+
+    os.environ.update(env)
+    log_fd = os.open("webhook.log", os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    logging.basicConfig(level=logging.INFO)
+    run_webhook(host="127.0.0.1", port=port, workers=workers)
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Синтетическая переписка: кнопка "Расчет совместимости", затем данные первого человека.
+# Если обновления пользователя обработаны по порядку, его итоговое состояние — ожидание второго человека
+def synthetic_updates(users, first_user_id):
+    updates = []
+    for i in range(users):
+        user_id = first_user_id + i
+        user = {"id": user_id, "is_bot": False, "first_name": f"Пользователь {user_id}"}
+        chat = {"id": user_id, "type": "private"}
+        updates.append({"update_id": 2 * user_id, "callback_query": {
+            "id": str(user_id), "from": user, "chat_instance": str(user_id), "data": "calculate_compatibility",
+            "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "text": "Меню"},
+        }})
+        updates.append({"update_id": 2 * user_id + 1, "message": {
+            "message_id": 2, "date": int(time.time()), "chat": chat, "from": user, "text": _birth_data(i),
+        }})
+    return updates
+
+
+async def _replay(url, updates, telegram, concurrency, idle_timeout=2.0):
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async def post(session, update):
+        async with semaphore:
+            async with session.post(url, json=update) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    accepted = time.perf_counter()
+
+    # Обработка закончена, когда бот перестал обращаться к Bot API
+    while True:
+        last = max(telegram.last_request.values(), default=started)
+        if time.perf_counter() - last >= idle_timeout:
+            break
+        await asyncio.sleep(0.1)
+    return statuses, accepted - started, last - started
+
+
+# Пропускная способность режима webhook при разном числе рабочих процессов: обновления (записанные
+# webhook_server в JSON Lines или синтетические) отправляются фронтальному серверу как можно быстрее
+def run_webhook_replay(args):
+    import multiprocessing
+    from state_store import SqliteStateStore
+
+    workdir = prepare_workdir(args.fonts_dir)
+    openai_stub = StubOpenAI(StubConfig(latency=args.llm_latency, seed=args.seed)).start()
+    telegram_stub = StubTelegram(StubConfig(latency=args.telegram_latency, seed=args.seed)).start()
+    env = {
+        "BOT_TOKEN": STUB_TOKEN,
+        "TELEGRAM_BASE_URL": telegram_stub.url,
+        "OPENAI_API_BASE": f"{openai_stub.url}/v1",
+        "OPENAI_API_KEY": "stub",
+        # Лимит Telegram здесь не нужен: замеряется собственная пропускная способность бота
+        "TELEGRAM_GLOBAL_LIMIT": "1000000",
+        "WORKER_METRICS_PORT": "0",
+    }
+    recorded = None
+    if args.updates:
+        with open(args.updates, encoding="utf-8") as updates_file:
+            recorded = [json.loads(line) for line in updates_file if line.strip()]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for run, workers in enumerate(int(count) for count in args.workers.split(",")):
+        first_user_id = (run + 1) * 1000000
+        updates = recorded or synthetic_updates(args.n or 2000, first_user_id)
+        port = _free_port()
+        front = context.Process(target=_webhook_front, args=(port, workers, env))
+        front.start()
+        while not _port_open(port):
+            time.sleep(0.2)
+
+        telegram_stub.last_request.clear()
+        statuses, accept_time, total_time = asyncio.run(
+            _replay(f"http://127.0.0.1:{port}/webhook", updates, telegram_stub, args.concurrency)
+        )
+        front.terminate()
+        front.join()
+
+        ordered = None
+        if recorded is None:
+            store = SqliteStateStore()
+            states = [asyncio.run(store.load(first_user_id + i)) for i in range(args.n or 2000)]
+            ordered = sum(1 for state in states if state.get("awaiting_data") == "person2") / len(states)
+        results.append({
+            "workers": workers,
+            "updates": len(updates),
+            "statuses": statuses,
+            "accept_time": round(accept_time, 3),
+            "total_time": round(total_time, 3),
+            "updates_per_second": round(len(updates) / total_time, 1),
+            "ordered_users": ordered,
+        })
+
+    openai_stub.stop()
+    telegram_stub.stop()
+    return {"scenario": "webhook", "commit": _git_commit(), "workdir": workdir, "runs": results}
+
+
+def _port_open(port):
+    import socket
+    with socket.socket() as sock:
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def print_webhook_result(result):
+    print(f"Сценарий webhook (коммит {result['commit']}), логи: {result['workdir']}/webhook.log")
+    for run in result["runs"]:
+        ordered = "" if run["ordered_users"] is None else f", порядок сохранён у {run['ordered_users']:.0%} пользователей"
+        print(
+            f"  процессов {run['workers']}: {run['updates']} обновлений за {run['total_time']:.2f} с "
+            f"({run['updates_per_second']:.0f} в секунду, приём {run['accept_time']:.2f} с), "
+            f"ответы фронта {run['statuses']}{ordered}"
+        )
+
+
+SCENARIOS = ("daily_post", "natal_charts", "compatibility", "webhook")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры без сети: OpenAI и Telegram заменены локальными заглушками")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("-n", type=int, default=None, help="Число запросов (для daily_post — прогонов)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Задержка OpenAI до первого токена, с")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Скорость генерации заглушки OpenAI")
+    parser.add_argument("--completion-tokens", type=int, default=300, help="Длина ответа заглушки OpenAI в токенах")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Доля ответов OpenAI с ошибкой 500")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Задержка Bot API, с")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="Доля ответов Bot API с ошибкой 502")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Доля ответов Bot API с ошибкой 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", default="1,2,4", help="webhook: числа рабочих процессов через запятую")
+    parser.add_argument("--updates", default=None, help="webhook: записанные обновления (JSON Lines)")
+    parser.add_argument("--concurrency", type=int, default=100, help="webhook: одновременных запросов к фронту")
+    parser.add_argument("--font", default=None, help="Путь к шрифту TTF для карточек гороскопа")
+    parser.add_argument("--fonts-dir", default=None, help="Папка со шрифтами DejaVu для PDF")
+    parser.add_argument("--json", default=None, help="Сохранить результат в JSON")
+    parser.add_argument("--compare", default=None, help="JSON с результатом другого коммита для сравнения")
+    args = parser.parse_args()
+    for path_arg in ("font", "fonts_dir", "json", "compare", "updates"):
+        if getattr(args, path_arg):
+            setattr(args, path_arg, os.path.abspath(getattr(args, path_arg)))
+
+    if args.scenario == "webhook":
+        result = run_webhook_replay(args)
+        print_webhook_result(result)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as result_file:
+                json.dump(result, result_file, ensure_ascii=False, indent=2)
+        sys.exit(0)
+
+    result = run_scenario(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_result(result, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as result_file:
+            json.dump(result, result_file, ensure_ascii=False, indent=2)
@@ -0,0 +1,83 @@
+import copy
+import os
+import threading
+
+# Шрифты с поддержкой кириллицы
+FONT_DIR = "./fonts"
+FONTS = (
+    ("", "DejaVuSans.ttf"),
+    ("B", "DejaVuSans-Bold.ttf"),
+    ("I", "DejaVuSans-Oblique.ttf"),
+)
+
+
+# Сборка PDF в памяти. Шрифты регистрируются один раз в документе-образце,
+# каждый новый документ — его копия со своими экземплярами файлов шрифтов
+class PdfBuilder:
+    def __init__(self, font_dir=FONT_DIR):
+        self.font_dir = font_dir
+        self._prototype = None
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        self.new_document()
+
+    def new_document(self):
+        with self._lock:
+            if self._prototype is None:
+                # fpdf импортируется только при первой сборке или прогреве: это самый тяжёлый импорт бота
+                from fpdf import FPDF
+                prototype = FPDF()
+                for style, file_name in FONTS:
+                    prototype.add_font('DejaVu', style, os.path.join(self.font_dir, file_name), uni=True)
+                self._prototype = prototype
+            pdf = copy.deepcopy(self._prototype)
+
+        # fpdf2 при копировании не дублирует разобранный шрифт (TTFont), а при сохранении
+        # урезает его до использованных символов на месте. Каждому документу нужен свой экземпляр,
+        # иначе одновременные и последовательные сборки портят шрифты друг другу.
+        # Ширины символов для вёрстки остаются общими (из образца), а TTFont открывается заново лениво:
+        # это около 30 мс на шрифт, тогда как глубокая копия полностью разобранного TTFont — около 370 мс
+        for font in pdf.fonts.values():
+            if hasattr(font, "ttfont"):
+                from fontTools.ttLib import TTFont
+                font.ttfont = TTFont(
+                    font.ttffile, recalcTimestamp=False, fontNumber=getattr(font, "collection_font_number", 0), lazy=True
+                )
+        return pdf
+
+    # PDF натальной карты; возвращает содержимое файла в байтах
+    def build_natal_chart(self, chart, houses, ascendant, detailed_interpretation):
+        pdf = self.new_document()
+        pdf.add_page()
+        pdf.set_font("DejaVu", size=12)
+
+        pdf.cell(200, 10, txt="Натальная карта", ln=True, align='C')
+        pdf.ln(10)
+
+        pdf.set_font("DejaVu", style="B", size=12)
+        pdf.cell(200, 10, txt="Планеты и Асцендент", ln=True, align='L')
+        pdf.set_font("DejaVu", size=12)
+        for key, value in chart.items():
+            pdf.cell(200, 10, txt=f"{key}: {value}", ln=True, align='L')
+
+        pdf.ln(10)
+        pdf.set_font("DejaVu", style="B", size=12)
+        pdf.cell(200, 10, txt="Дома", ln=True, align='L')
+        pdf.set_font("DejaVu", size=12)
+        for key, value in houses.items():
+            pdf.cell(200, 10, txt=f"{key}: {value}", ln=True, align='L')
+
+        pdf.cell(200, 10, txt=f"Асцендент: {ascendant}", ln=True, align='L')
+
+        pdf.ln(10)
+        pdf.set_font("DejaVu", style="B", size=12)
+        pdf.cell(200, 10, txt="Детальная интерпретация", ln=True, align='L')
+        pdf.set_font("DejaVu", size=12)
+        pdf.multi_cell(0, 10, detailed_interpretation)
+
+        # fpdf 1.7 возвращает строку latin-1, fpdf2 — bytearray
+        data = pdf.output(dest='S')
+        if isinstance(data, str):
+            return data.encode('latin-1')
+        return bytes(data)
@@ -0,0 +1,137 @@
+import logging
+from collections import namedtuple
+from functools import lru_cache
+
+import metrics
+from chart_engine import SIGNS
+
+logger = logging.getLogger(__name__)
+
+# Общее начало всех запросов. Оно одинаково во всех сценариях и стоит первым,
+# поэтому совпадающий префикс запросов может кэшироваться на стороне модели
+SYSTEM_PROMPT = (
+    "Ты профессиональный астролог и толкователь снов. Используй классические трактовки, пиши по-русски "
+    "реалистично, убедительно и без противоречий, с индивидуальной конкретикой, обращаясь к клиенту. "
+    "Формат данных карты: «планета знак градус»; дома — «номер знак градус»; Асц — асцендент."
+)
+
+# Задание каждого сценария; данные идут после него
+FLOW_INSTRUCTIONS = {
+    "chart_short": (
+        "Составь краткую натальную карту: 8 пунктов о влиянии планет и их взаимодействии "
+        "на личность, пункт об асценденте, общий вывод."
+    ),
+    "chart_detailed": (
+        "Составь полную натальную карту: подробно о 10 планетах, каждый дом по пунктам, общий полный вывод. "
+        "Не противоречь краткой трактовке."
+    ),
+    "compatibility": (
+        "Сделай подробный анализ совместимости двух натальных карт: сильные и слабые стороны взаимодействия, "
+        "сопоставь черты характера (например: первый идеен и оптимистичен, второй ценит комфорт — это мешает)."
+    ),
+    "financial": (
+        "Составь финансовую интерпретацию натальной карты на текущую дату. Структура: сильные стороны, "
+        "слабые стороны, конкретные рекомендации."
+    ),
+    "dream": (
+        "Дай подробное, но реалистичное толкование сна: основные символы и их значение, общий смысл, "
+        "рекомендации. Сон:"
+    ),
+}
+
+# Бюджеты сценариев в токенах: (запрос, ответ). Ответ ограничивается через max_tokens,
+# запрос сверх бюджета отмечается в логе и метриках
+FLOW_BUDGETS = {
+    "chart_short": (400, 1500),
+    "chart_detailed": (500, 3000),
+    "compatibility": (500, 1500),
+    "financial": (500, 1000),
+    "dream": (800, 1000),
+}
+
+# Сколько символов русского текста укладывается в токен ответа, с запасом (в среднем около 2.5).
+# По нему в задание добавляется допустимая длина ответа, чтобы max_tokens не обрывал его на полуслове
+ANSWER_CHARS_PER_TOKEN = 2
+
+# Служебные токены разметки на каждое сообщение (оценка OpenAI для chat-моделей)
+TOKENS_PER_MESSAGE = 4
+
+Prompt = namedtuple("Prompt", ["messages", "max_tokens", "prompt_tokens"])
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# Число токенов текста. Без пакета tiktoken — оценка с запасом:
+# латиница около 4 символов на токен, кириллица около 2.5
+def count_tokens(text, model):
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 2.5) + 1
+
+
+def count_message_tokens(messages, model):
+    return sum(count_tokens(message["content"], model) + TOKENS_PER_MESSAGE for message in messages)
+
+
+# Обрезает текст до tokens токенов
+def truncate_tokens(text, tokens, model):
+    encoding = _encoding(model)
+    if encoding is not None:
+        encoded = encoding.encode(text)
+        return text if len(encoded) <= tokens else encoding.decode(encoded[:tokens])
+    while text and count_tokens(text, model) > tokens:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+# Компактная запись положения: знак и целый градус, например "Лев 12"
+def _position(degree):
+    return f"{SIGNS[int(degree // 30) % 12]} {int(degree % 30)}"
+
+
+# Каноническая запись карты для модели: одна строка на планеты, одна на дома
+def encode_chart(chart, houses=True):
+    lines = ["Планеты: " + "; ".join(f"{name} {_position(degree)}" for name, degree in chart.planets)]
+    if houses:
+        lines.append("Дома: " + "; ".join(f"{i} {_position(cusp)}" for i, cusp in enumerate(chart.cusps, 1)))
+    lines.append(f"Асц: {_position(chart.ascendant)}")
+    return "\n".join(lines)
+
+
+# Сообщения для модели и max_tokens сценария flow. data — данные, дописываемые после задания.
+# trim=True обрезает данные под бюджет (текст пользователя), иначе превышение только отмечается
+def build_prompt(flow, data, model, trim=False):
+    prompt_budget, max_tokens = FLOW_BUDGETS[flow]
+    answer_chars = max_tokens * ANSWER_CHARS_PER_TOKEN // 100 * 100
+    instruction = f"Ответ — законченный текст до {answer_chars} символов. {FLOW_INSTRUCTIONS[flow]}"
+
+    def messages_for(text):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"{instruction}\n{text}"},
+        ]
+
+    messages = messages_for(data)
+    prompt_tokens = count_message_tokens(messages, model)
+    if prompt_tokens > prompt_budget:
+        if trim:
+            spare = prompt_budget - count_message_tokens(messages_for(""), model)
+            messages = messages_for(truncate_tokens(data, max(0, spare), model))
+            logger.info(f"Данные сценария {flow} обрезаны: {prompt_tokens} токенов при бюджете {prompt_budget}")
+            prompt_tokens = count_message_tokens(messages, model)
+        else:
+            logger.warning(f"Запрос сценария {flow} превышает бюджет: {prompt_tokens} токенов из {prompt_budget}")
+            metrics.increment("prompt_over_budget", flow=flow)
+    return Prompt(messages, max_tokens, prompt_tokens)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько тяжёлых запросов выполняется одновременно и сколько может ждать в очереди
+WORKERS = 8
+MAX_QUEUE = 200
+
+# Результаты постановки в очередь
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+FULL = "full"
+
+
+# Очередь тяжёлых запросов (карты, совместимость, толкования) с ограниченным числом исполнителей.
+# Повторный запрос того же типа от того же пользователя, пока первый не выполнен, не ставится
+class RequestQueue:
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = None
+        self._tasks = []
+        self._in_flight = set()
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            key, job = await self._queue.get()
+            try:
+                await job()
+            except Exception as e:
+                logger.exception(f"Ошибка выполнения запроса {key}: {e}")
+            finally:
+                self._in_flight.discard(key)
+                self._queue.task_done()
+
+    # job — функция без аргументов, возвращающая корутину.
+    # Возвращает (статус, позиция в очереди); позиция 0 — запрос начнёт выполняться сразу
+    def submit(self, user_id, job_type, job):
+        self._ensure_workers()
+        key = (user_id, job_type)
+        if key in self._in_flight:
+            return DUPLICATE, None
+        if self._waiting() >= self.max_queue:
+            return FULL, None
+
+        self._in_flight.add(key)
+        self._queue.put_nowait((key, job))
+        return ACCEPTED, self._waiting()
+
+    # Сколько запросов ждёт свободного исполнителя (часть очереди сразу разберут простаивающие)
+    def _waiting(self):
+        running = len(self._in_flight) - self._queue.qsize()
+        return max(0, self._queue.qsize() - (self.workers - running))
+
+    def stats(self):
+        return {
+            "queued": self._waiting() if self._queue else 0,
+            "in_flight": len(self._in_flight),
+            "workers": self.workers,
+        }
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Файл с временем последнего запуска задач (для догоняющих запусков после перезапуска)
+SCHEDULER_STATE_PATH = "./scheduler_state.json"
+# Сколько максимум спать за раз, чтобы не пропустить перевод часов
+MAX_SLEEP = 60
+
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/")
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-")
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Значение вне диапазона {low}-{high}: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+# Расписание в формате cron: "минута час день месяц день_недели" (0 — воскресенье)
+class CronSchedule:
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Ожидается 5 полей cron: {expression}")
+        self.expression = expression
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in _parse_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        # Как в cron: если заданы и день месяца, и день недели, достаточно любого из них
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    # Ближайший момент срабатывания строго после after
+    def next_after(self, after):
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Расписание никогда не срабатывает: {self.expression}")
+
+
+# Задача планировщика. func — корутина без аргументов;
+# catch_up — насколько поздно ещё можно выполнить пропущенный запуск
+class Job:
+    def __init__(self, name, cron, func, catch_up=timedelta(hours=2)):
+        self.name = name
+        self.schedule = CronSchedule(cron)
+        self.func = func
+        self.catch_up = catch_up
+        self.next_run = None
+        self.task = None
+
+
+# Асинхронный планировщик: спит до ближайшего запуска, не допускает наложения запусков одной задачи
+# и после перезапуска догоняет пропущенные запуски
+class Scheduler:
+    def __init__(self, jobs, state_path=SCHEDULER_STATE_PATH):
+        self.jobs = jobs
+        self.state_path = state_path
+        self._state = self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать состояние планировщика: {e}")
+            return {}
+
+    def _save_state(self):
+        with open(self.state_path, "w", encoding="utf-8") as state_file:
+            json.dump(self._state, state_file, ensure_ascii=False, indent=2)
+
+    def _plan(self, now):
+        for job in self.jobs:
+            last_run = self._state.get(job.name)
+            if last_run:
+                # Последний пропущенный запуск: раньше пропущенные уже не актуальны
+                missed = job.schedule.next_after(datetime.fromisoformat(last_run))
+                while missed <= now and job.schedule.next_after(missed) <= now:
+                    missed = job.schedule.next_after(missed)
+                if missed <= now and now - missed <= job.catch_up:
+                    logger.info(f"Догоняющий запуск задачи {job.name} (пропущен {missed:%d.%m.%Y %H:%M})")
+                    job.next_run = now
+                    continue
+            job.next_run = job.schedule.next_after(now)
+
+    # При ошибке возвращается прежнее время запуска, чтобы после перезапуска задача была догнана
+    async def _run_job(self, job, planned):
+        logger.info(f"Запуск задачи {job.name}")
+        previous = self._state.get(job.name)
+        self._state[job.name] = planned.isoformat()
+        self._save_state()
+        try:
+            await job.func()
+        except Exception as e:
+            logger.exception(f"Ошибка в задаче {job.name}: {e}")
+            if previous is None:
+                self._state.pop(job.name, None)
+            else:
+                self._state[job.name] = previous
+            self._save_state()
+
+    def _start(self, job, now):
+        if job.task is not None and not job.task.done():
+            logger.warning(f"Задача {job.name} ещё выполняется, запуск пропущен")
+        else:
+            job.task = asyncio.create_task(self._run_job(job, job.next_run))
+        job.next_run = job.schedule.next_after(max(now, job.next_run))
+
+    async def run(self):
+        self._plan(datetime.now())
+        for job in self.jobs:
+            logger.info(f"Задача {job.name}: следующий запуск {job.next_run:%d.%m.%Y %H:%M}")
+
+        while True:
+            now = datetime.now()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    self._start(job, now)
+            nearest = min(job.next_run for job in self.jobs)
+            delay = (nearest - datetime.now()).total_seconds()
+            await asyncio.sleep(min(max(delay, 0), MAX_SLEEP))
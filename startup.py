@@ -0,0 +1,62 @@
+import logging
+import threading
+import time
+from concurrent.futures import wait
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать прогрева перед началом опроса; не успевшие задачи досчитываются в фоне
+WARM_UP_TIMEOUT = 30
+
+
+# Отчёт о времени запуска: последовательные этапы отмечаются mark, фоновые задачи прогрева — measure
+class StartupReport:
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.steps = []
+        self._last_mark = self.started
+        self._lock = threading.Lock()
+
+    def _add(self, name, seconds, background=False):
+        with self._lock:
+            self.steps.append((name, seconds, background))
+
+    # Этап, закончившийся сейчас и начавшийся с предыдущей отметки
+    def mark(self, name):
+        now = time.perf_counter()
+        self._add(name, now - self._last_mark)
+        self._last_mark = now
+
+    def measure(self, name, func):
+        started = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self._add(name, time.perf_counter() - started, background=True)
+
+    def log(self):
+        total = time.perf_counter() - self.started
+        lines = [f"Запуск занял {total:.2f} с:"]
+        for name, seconds, background in self.steps:
+            suffix = " (в фоне)" if background else ""
+            lines.append(f"  {name}: {seconds:.2f} с{suffix}")
+        logger.info("\n".join(lines))
+
+
+def _warm_up_task(report, name, func):
+    try:
+        report.measure(name, func)
+    except Exception as e:
+        logger.warning(f"Прогрев {name} не удался: {e}")
+
+
+# Запуск прогрева: tasks — тройки (название, пул, функция). Возвращает futures для wait_warm_up
+def start_warm_up(report, tasks):
+    return [pool.submit(_warm_up_task, report, name, func) for name, pool, func in tasks]
+
+
+def wait_warm_up(report, futures, timeout=WARM_UP_TIMEOUT):
+    _, pending = wait(futures, timeout=timeout)
+    if pending:
+        logger.warning(f"Прогрев не завершился за {timeout} с, продолжаем без ожидания ({len(pending)} задач)")
+    report.mark("ожидание прогрева")
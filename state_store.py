@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Хранилище состояния диалогов: "sqlite" (по умолчанию) или "redis"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = "./conversation_state.sqlite3"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = "starbutts:state:"
+
+# Через сколько секунд без сообщений незавершённый диалог забывается
+STATE_TTL = 24 * 3600
+# Раз в сколько записей удалять просроченные состояния из SQLite
+PURGE_EVERY = 500
+
+
+def _encode(state):
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+
+# Состояние в SQLite: одна строка на пользователя, WAL позволяет нескольким процессам бота
+# читать и писать одну базу одновременно
+class SqliteStateStore:
+    def __init__(self, db_path=STATE_DB_PATH, ttl=STATE_TTL):
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_state ("
+            "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    async def load(self, user_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM conversation_state WHERE user_id = ? AND expires > ?", (user_id, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    # Пустое состояние удаляет запись
+    async def save(self, user_id, state):
+        now = time.time()
+        with self._lock:
+            if state:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO conversation_state VALUES (?, ?, ?)", (user_id, _encode(state), now + self.ttl)
+                )
+            else:
+                self._db.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._db.execute("DELETE FROM conversation_state WHERE expires <= ?", (now,))
+            self._db.commit()
+
+
+# Состояние в Redis (или совместимом сервере): срок жизни задаётся самим ключом.
+# Нужен пакет redis
+class RedisStateStore:
+    def __init__(self, url=REDIS_URL, ttl=STATE_TTL, key_prefix=REDIS_KEY_PREFIX):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            raise RuntimeError("Для STATE_BACKEND=redis установите пакет redis")
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._redis = redis_asyncio.from_url(url)
+
+    async def load(self, user_id):
+        data = await self._redis.get(f"{self.key_prefix}{user_id}")
+        return json.loads(data) if data else {}
+
+    async def save(self, user_id, state):
+        key = f"{self.key_prefix}{user_id}"
+        if state:
+            await self._redis.set(key, _encode(state), ex=self.ttl)
+        else:
+            await self._redis.delete(key)
+
+
+def create_state_store(backend=STATE_BACKEND):
+    if backend == "sqlite":
+        return SqliteStateStore()
+    if backend == "redis":
+        return RedisStateStore()
+    raise ValueError(f"Неизвестное хранилище состояния: {backend}")
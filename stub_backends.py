@@ -0,0 +1,193 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+from chart_engine import SIGNS
+
+# Слово-заглушка: в потоковом ответе одна часть — один "токен"
+STUB_WORD = "звёзды "
+
+
+# Параметры задержек и ошибок одного бэкенда.
+# latency — задержка до первого байта (с разбросом ±jitter), error_rate — доля ответов с ошибкой
+class StubConfig:
+    def __init__(self, latency=0.2, jitter=0.25, error_rate=0.0, tokens_per_second=50.0,
+                 completion_tokens=300, flood_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.flood_rate = flood_rate
+        self.seed = seed
+
+
+# Локальный HTTP-сервер в отдельном потоке со своим циклом событий,
+# чтобы работа заглушки не отнимала время у цикла событий испытуемого кода
+class StubServer:
+    def __init__(self, config):
+        self.config = config
+        self.requests = defaultdict(int)
+        self.errors = 0
+        self.url = None
+        self._random = random.Random(config.seed)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def _routes(self, app):
+        raise NotImplementedError
+
+    def _delay(self):
+        spread = self.config.latency * self.config.jitter
+        return max(0.0, self.config.latency + self._random.uniform(-spread, spread))
+
+    def _fail(self, rate):
+        return rate and self._random.random() < rate
+
+    async def _serve(self, started):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        self._routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        started.set()
+
+    def start(self):
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._serve(started))
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+# Заглушка /v1/chat/completions (обычные и потоковые ответы).
+# На просьбу вернуть JSON отвечает объектом с упомянутыми в запросе знаками зодиака
+class StubOpenAI(StubServer):
+    def _routes(self, app):
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+
+    def _content(self, messages, tokens):
+        prompt = messages[-1]["content"] if messages else ""
+        text = (STUB_WORD * tokens).strip()
+        if "JSON" in prompt:
+            signs = [sign for sign in SIGNS if sign in prompt]
+            words_per_sign = max(1, tokens // max(1, len(signs)))
+            return json.dumps({sign: (STUB_WORD * words_per_sign).strip() for sign in signs}, ensure_ascii=False)
+        return text
+
+    async def chat_completions(self, request):
+        self.requests["chat_completions"] += 1
+        body = await request.json()
+        await asyncio.sleep(self._delay())
+        if self._fail(self.config.error_rate):
+            self.errors += 1
+            return web.json_response(
+                {"error": {"message": "Stub server error", "type": "server_error"}}, status=500
+            )
+
+        tokens = min(self.config.completion_tokens, body.get("max_tokens") or self.config.completion_tokens)
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        content = self._content(body["messages"], tokens)
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            await asyncio.sleep(tokens / self.config.tokens_per_second)
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        pieces = content.split(" ")
+        interval = 1 / self.config.tokens_per_second
+        for i, piece in enumerate(pieces):
+            delta = {"content": piece if i == len(pieces) - 1 else piece + " "}
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(interval)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+# Заглушка Bot API: отвечает правдоподобными объектами Message и запоминает,
+# когда в каждый чат пришёл последний запрос (по нему считается время ответа пользователю)
+class StubTelegram(StubServer):
+    def __init__(self, config):
+        super().__init__(config)
+        self.last_request = {}
+        self._message_id = 0
+
+    def _routes(self, app):
+        app.router.add_post("/bot{token}/{method}", self.bot_method)
+
+    def _message(self, chat_id, **fields):
+        self._message_id += 1
+        chat_type = "private" if chat_id > 0 else "channel"
+        return {"message_id": self._message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": chat_type}, **fields}
+
+    def _file(self, prefix):
+        return {"file_id": f"{prefix}-{self._message_id}", "file_unique_id": f"{prefix}-u{self._message_id}"}
+
+    async def bot_method(self, request):
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        params = await request.post()
+        await asyncio.sleep(self._delay())
+
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"
+            }})
+
+        if self._fail(self.config.flood_rate):
+            self.errors += 1
+            return web.json_response({
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }, status=429)
+        if self._fail(self.config.error_rate):
+            self.errors += 1
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+
+        chat_id = params.get("chat_id", "0")
+        chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else -100
+        self.last_request[chat_id] = time.perf_counter()
+
+        if method in ("answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            result = True
+        elif method == "sendMediaGroup":
+            media = json.loads(params["media"])
+            result = [self._message(chat_id, photo=[{**self._file("photo"), "width": 1080, "height": 1080}]) for _ in media]
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[{**self._file("photo"), "width": 1080, "height": 1080}])
+        elif method == "sendDocument":
+            result = self._message(chat_id, document=self._file("document"))
+        else:
+            result = self._message(chat_id, text=params.get("text", ""))
+        return web.json_response({"ok": True, "result": result})
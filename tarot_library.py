@@ -0,0 +1,96 @@
+import random
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+# Файл библиотеки заранее сгенерированных описаний карт Таро
+TAROT_LIBRARY_PATH = "./tarot_library.sqlite3"
+POOL_SIZE = 3  # Сколько неиспользованных описаний держать для каждой карты
+MAX_AGE_DAYS = 30  # Через сколько дней описание считается устаревшим и заменяется
+REFILL_BATCH = 3  # Сколько описаний генерируется за один запуск пополнения
+OFF_PEAK_HOURS = range(0, 7)  # Часы, в которые пополнение разрешено
+
+
+# Пул описаний карт: утренний пост берёт готовое описание, пополнение идёт понемногу в фоне
+class TarotLibrary:
+    def __init__(self, db_path=TAROT_LIBRARY_PATH, pool_size=POOL_SIZE, max_age_days=MAX_AGE_DAYS):
+        self.pool_size = pool_size
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tarot_descriptions ("
+            "id INTEGER PRIMARY KEY, card TEXT NOT NULL, description TEXT NOT NULL, "
+            "generated_on TEXT NOT NULL, used_on TEXT)"
+        )
+        self._db.commit()
+
+    # Готовое описание для карты или None; выданное описание помечается использованным
+    def take(self, card_name, today=None):
+        today = (today or date.today()).isoformat()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, description FROM tarot_descriptions WHERE card = ? AND used_on IS NULL", (card_name,)
+            ).fetchall()
+            if not rows:
+                # Пул пуст — повторно используем самое свежее описание
+                rows = self._db.execute(
+                    "SELECT id, description FROM tarot_descriptions WHERE card = ? "
+                    "ORDER BY generated_on DESC LIMIT 1", (card_name,)
+                ).fetchall()
+            if not rows:
+                return None
+            entry_id, description = random.choice(rows)
+            self._db.execute("UPDATE tarot_descriptions SET used_on = ? WHERE id = ?", (today, entry_id))
+            self._db.commit()
+            return description
+
+    def add(self, card_name, description, generated_on=None):
+        generated_on = (generated_on or date.today()).isoformat()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO tarot_descriptions (card, description, generated_on) VALUES (?, ?, ?)",
+                (card_name, description, generated_on)
+            )
+            self._db.commit()
+
+    # Сколько описаний не хватает каждой карте. Устаревшие неиспользованные описания удаляются,
+    # использованные остаются запасом, пока карте не сгенерируют новые
+    def deficits(self, card_names, today=None):
+        today = today or date.today()
+        stale_before = (today - timedelta(days=self.max_age_days)).isoformat()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM tarot_descriptions WHERE used_on IS NULL AND generated_on < ?", (stale_before,)
+            )
+            self._db.commit()
+            counts = dict(self._db.execute(
+                "SELECT card, COUNT(*) FROM tarot_descriptions WHERE used_on IS NULL GROUP BY card"
+            ).fetchall())
+
+            # Использованные описания больше не нужны картам с полным пулом
+            full_cards = [card for card in card_names if counts.get(card, 0) >= self.pool_size]
+            self._db.executemany(
+                "DELETE FROM tarot_descriptions WHERE card = ? AND used_on IS NOT NULL",
+                [(card,) for card in full_cards]
+            )
+            self._db.commit()
+        return {card: self.pool_size - counts.get(card, 0) for card in card_names if counts.get(card, 0) < self.pool_size}
+
+    # Пополнение не больше batch описаний за запуск, начиная с карт с наибольшей нехваткой.
+    # generate — корутина, возвращающая описание по названию карты
+    async def top_up(self, card_names, generate, batch=REFILL_BATCH, force=False):
+        if not force and datetime.now().hour not in OFF_PEAK_HOURS:
+            return 0
+
+        deficits = self.deficits(card_names)
+        queue = sorted(deficits, key=deficits.get, reverse=True)
+        generated = 0
+        for card_name in queue:
+            if generated >= batch:
+                break
+            description = await generate(card_name)
+            if description:
+                self.add(card_name, description)
+                generated += 1
+        return generated
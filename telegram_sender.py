@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import httpx
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: в среднем не больше 1 сообщения в секунду в личный чат (короткие всплески допустимы),
+# 20 сообщений в минуту в группу или канал и 30 сообщений в секунду всего
+PRIVATE_CHAT_LIMIT = (3, 3.0)
+GROUP_CHAT_LIMIT = (20, 60.0)
+GLOBAL_LIMIT = (30, 1.0)
+
+# Максимальная длина сообщения и интервал между правками потокового ответа
+MAX_MESSAGE_LENGTH = 4096
+STREAM_EDIT_INTERVAL = 1.5
+
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0  # Начальная пауза при сетевых ошибках (в секундах)
+MAX_SLOWDOWN = 8.0  # Во сколько раз максимум замедляемся после flood control
+
+
+# Скользящее окно: не больше limit отправок за period секунд
+class SlidingWindow:
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.slowdown = 1.0
+        self.blocked_until = 0.0
+        self.timestamps = deque()
+
+    # Ближайший момент, когда можно отправить cost сообщений
+    def earliest(self, now, cost):
+        period = self.period * self.slowdown
+        while self.timestamps and self.timestamps[0] <= now - period:
+            self.timestamps.popleft()
+
+        cost = min(cost, self.limit)
+        moment = max(now, self.blocked_until)
+        if len(self.timestamps) > self.limit - cost:
+            moment = max(moment, self.timestamps[-(self.limit - cost + 1)] + period)
+        if self.timestamps:
+            moment = max(moment, self.timestamps[-1])
+        return moment
+
+    def reserve(self, moment, cost):
+        self.timestamps.extend([moment] * min(cost, self.limit))
+
+    def flood(self, now, retry_after):
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.slowdown = min(self.slowdown * 2, MAX_SLOWDOWN)
+
+    def success(self):
+        self.slowdown = max(1.0, self.slowdown * 0.9)
+
+
+def _is_group_chat(chat_id):
+    if isinstance(chat_id, str):
+        return chat_id.startswith("@") or chat_id.startswith("-")
+    return chat_id < 0
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# Место в окне резервируется сразу, затем ожидание до зарезервированного момента
+async def _wait_slot(window, cost):
+    now = time.monotonic()
+    moment = window.earliest(now, cost)
+    window.reserve(moment, cost)
+    if moment > now:
+        await asyncio.sleep(moment - now)
+
+
+# Запрос точно не дошёл до Telegram: не нашлось свободного соединения или его не удалось установить.
+# После обрыва или таймаута ответа сообщение могло быть уже доставлено
+def _not_sent(error):
+    return isinstance(error.__cause__, (httpx.PoolTimeout, httpx.ConnectTimeout, httpx.ConnectError))
+
+
+# Отправка в Telegram с учётом лимитов, flood control и повторами при ошибках
+class TelegramSender:
+    def __init__(self, bot=None, max_retries=MAX_RETRIES, global_limit=GLOBAL_LIMIT):
+        self.bot = bot
+        self.max_retries = max_retries
+        self._chats = {}
+        self._global = SlidingWindow(*global_limit)
+
+    def _chat_window(self, chat_id):
+        window = self._chats.get(chat_id)
+        if window is None:
+            limit = GROUP_CHAT_LIMIT if _is_group_chat(chat_id) else PRIVATE_CHAT_LIMIT
+            window = self._chats[chat_id] = SlidingWindow(*limit)
+        return window
+
+    # Ожидание, пока отправка разрешена: сначала в окне своего чата, затем в общем окне.
+    # Общее место занимается только после ожидания чата, иначе очередь или flood control
+    # одного чата задерживали бы отправки во все остальные
+    async def _acquire(self, chat_id, cost):
+        await _wait_slot(self._chat_window(chat_id), cost)
+        await _wait_slot(self._global, cost)
+
+    # request — функция без аргументов, возвращающая корутину запроса к API.
+    # Повтор после сетевой ошибки только для idempotent-запросов (правка сообщения) или если запрос
+    # не был отправлен: иначе повтор отправки может продублировать сообщение
+    async def call(self, chat_id, request, cost=1, idempotent=False):
+        chat_window = self._chat_window(chat_id)
+        backoff = BASE_BACKOFF
+        for attempt in range(self.max_retries + 1):
+            with metrics.span("telegram_wait"):
+                await self._acquire(chat_id, cost)
+            try:
+                with metrics.span("telegram"):
+                    result = await request()
+                chat_window.success()
+                return result
+            except RetryAfter as e:
+                retry_after = _retry_after_seconds(e)
+                logger.warning(f"Flood control для чата {chat_id}: ожидание {retry_after} с")
+                chat_window.flood(time.monotonic(), retry_after)
+                if attempt == self.max_retries:
+                    raise
+            except BadRequest:
+                # BadRequest в PTB — подкласс NetworkError, но повтор его не исправит
+                raise
+            except NetworkError as e:
+                if attempt == self.max_retries or not (idempotent or _not_sent(e)):
+                    raise
+                logger.warning(f"Ошибка сети при отправке в чат {chat_id}: {e}, повтор через {backoff} с")
+                await asyncio.sleep(backoff)
+                backoff *= 2
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return await self.call(
+            chat_id,
+            lambda: self.bot.send_media_group(chat_id=chat_id, media=media, **kwargs),
+            cost=len(media)
+        )
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self.call(chat_id, lambda: self.bot.send_photo(chat_id=chat_id, photo=photo, **kwargs))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self.call(chat_id, lambda: self.bot.send_document(chat_id=chat_id, document=document, **kwargs))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self.call(chat_id, lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs))
+
+    async def reply_text(self, message, text, **kwargs):
+        return await self.call(message.chat_id, lambda: message.reply_text(text, **kwargs))
+
+    async def reply_document(self, message, document, **kwargs):
+        return await self.call(message.chat_id, lambda: message.reply_document(document=document, **kwargs))
+
+    async def edit_text(self, message, text, **kwargs):
+        try:
+            return await self.call(message.chat_id, lambda: message.edit_text(text, **kwargs), idempotent=True)
+        except BadRequest as e:
+            # Текст не изменился — правка не нужна
+            if "not modified" not in str(e).lower():
+                raise
+
+
+# Точка разреза длинного текста: по переводу строки или пробелу, но не раньше середины
+def _split_point(text, limit):
+    for separator in ("\n", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut != -1:
+            return cut + 1
+    return limit
+
+
+# Потоковый ответ: заглушка, которая дописывается правками не чаще раза в interval секунд.
+# Текст длиннее лимита Telegram продолжается в новом сообщении
+class StreamingReply:
+    def __init__(self, sender, message, prefix="", placeholder="…", interval=STREAM_EDIT_INTERVAL):
+        self.sender = sender
+        self.message = message
+        self.prefix = prefix
+        self.placeholder = placeholder
+        self.interval = interval
+        self.text = ""
+        self._current = None
+        self._head = prefix
+        self._offset = 0
+        self._shown = None
+
+    async def _flush(self):
+        display = self._head + self.text[self._offset:]
+        while len(display) > MAX_MESSAGE_LENGTH:
+            cut = _split_point(display, MAX_MESSAGE_LENGTH)
+            await self.sender.edit_text(self._current, display[:cut])
+            self._offset += cut - len(self._head)
+            self._head = ""
+            display = self.text[self._offset:]
+            # Новое сообщение начинается с заглушки, текст в него дописывается следующей правкой:
+            # остаток сам может быть длиннее лимита (например, ответ из кэша одной частью)
+            self._current = await self.sender.reply_text(self.message, self.placeholder)
+            self._shown = self.placeholder
+        if display and display != self._shown:
+            await self.sender.edit_text(self._current, display)
+            self._shown = display
+
+    # chunks — асинхронный итератор частей текста (например, llm_client.stream_completion)
+    async def stream(self, chunks):
+        self._current = await self.sender.reply_text(self.message, self.prefix + self.placeholder)
+        last_edit = time.monotonic()
+        async for chunk in chunks:
+            self.text += chunk if self.text else chunk.lstrip()
+            if time.monotonic() - last_edit >= self.interval:
+                await self._flush()
+                last_edit = time.monotonic()
+        self.text = self.text.rstrip()
+        await self._flush()
+        return self.text
@@ -1,21 +1,59 @@
-import schedule
-import time
 import asyncio
+import logging
+import os
 
-from Horoscope import main
+from telegram import Bot
+
+import metrics
+from Horoscope import (
+    RUN_SUMMARY_PATH, TELEGRAM_BOT_TOKEN, main, prepare_daily_bundle, publish_daily_bundle, refill_tarot_library
+)
+from scheduler import Job, Scheduler
+from telegram_sender import TelegramSender
 # from test import main
 
-# Асинхронный запуск основной задачи
-def run_daily_task():
-    print("Запуск задачи на отправку гороскопа и карты дня...")
-    asyncio.run(main())
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# Двухфазный режим: выпуск готовится заранее, в 8:29 остаётся только отправка
+TWO_PHASE = True
+
+# Порт эндпоинта /metrics (0 — не запускать)
+METRICS_PORT = int(os.getenv("SCHEDULER_METRICS_PORT", "9109"))
+
+
+# Запуск задачи с сохранением JSON-сводки по её этапам
+def with_summary(name, func):
+    async def run():
+        with metrics.run_summary(name, RUN_SUMMARY_PATH):
+            await func()
+    return run
+
+
+# Планировщик работает в одном цикле событий с одним ботом и пулом HTTP-соединений на все запуски
+async def run_scheduler():
+    async with Bot(token=TELEGRAM_BOT_TOKEN) as bot:
+        sender = TelegramSender(bot)
+        if TWO_PHASE:
+            jobs = [
+                Job("prepare", "0 7 * * *", with_summary("prepare", prepare_daily_bundle)),
+                Job("publish", "29 8 * * *", with_summary("publish", lambda: publish_daily_bundle(sender))),
+            ]
+        else:
+            # Гороскопы и карта дня в 8:29
+            jobs = [Job("daily_post", "29 8 * * *", with_summary("daily_post", lambda: main(sender)))]
 
-# Запуск задачи по расписанию в 9:01
-schedule.every().day.at("08:29").do(run_daily_task)
+        jobs += [
+            # Пополнение библиотеки описаний карт Таро (само пополнение идёт только ночью)
+            Job("tarot_refill", "*/20 * * * *", refill_tarot_library),
+        ]
+        metrics.start_metrics_server(METRICS_PORT)
+        print("Планировщик запущен. Ожидание следующего запуска...")
+        await Scheduler(jobs).run()
 
-print("Планировщик запущен. Ожидание следующего запуска...")
 
-# Постоянный цикл для выполнения задач по расписанию
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+if __name__ == "__main__":
+    asyncio.run(run_scheduler())
@@ -0,0 +1,33 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+# Параллельная обработка обновлений разных пользователей; обновления одного пользователя
+# обрабатываются строго по очереди, в порядке поступления
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        key = user.id if user else None
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            # Блокировка удаляется, когда у пользователя не осталось обновлений в обработке
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
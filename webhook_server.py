@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Адрес, на котором принимаются обновления (за обратным прокси с TLS)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = "/webhook"
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: чужие запросы отклоняются
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# Сколько обновлений может ждать в очереди одного процесса; при переполнении Telegram повторит доставку
+WORKER_QUEUE_SIZE = 10000
+# Файл для записи входящих обновлений (JSON Lines), чтобы потом воспроизвести их в offline_bench
+WEBHOOK_RECORD_PATH = os.getenv("WEBHOOK_RECORD_PATH")
+# Метрики рабочего процесса i публикуются на порту WORKER_METRICS_PORT + i (0 — не публиковать)
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9120"))
+WORKER_START_TIMEOUT = 120
+
+# Поля обновления, в которых есть отправитель
+UPDATE_SENDER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+# Пользователь, к которому относится обновление; обновления без отправителя идут по чату или в процесс 0
+def update_user_id(update):
+    for field in UPDATE_SENDER_FIELDS:
+        payload = update.get(field)
+        if payload:
+            sender = payload.get("from") or payload.get("user") or payload.get("chat") or {}
+            return sender.get("id", 0)
+    return 0
+
+
+# Рабочий процесс: своё приложение Starbutts без опроса, обновления приходят из очереди
+def _worker_main(index, workers, updates, ready):
+    os.environ["STARBUTTS_WORKERS"] = str(workers)
+    os.environ["STARBUTTS_METRICS_PORT"] = str(WORKER_METRICS_PORT + index if WORKER_METRICS_PORT else 0)
+    import Starbutts
+
+    asyncio.run(_worker_loop(Starbutts, updates, ready))
+
+
+async def _worker_loop(Starbutts, updates, ready):
+    from telegram import Update
+
+    app = Starbutts.prepare_application(polling=False)
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.start()
+        ready.set()
+        while True:
+            body = await loop.run_in_executor(None, updates.get)
+            if body is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(body), app.bot))
+        await app.stop()
+
+
+# Приём обновлений по HTTP и раздача по рабочим процессам. Обновления одного пользователя
+# всегда попадают в один процесс, где обрабатываются по очереди, поэтому их порядок сохраняется
+class WebhookDispatcher:
+    def __init__(self, workers=WEBHOOK_WORKERS, secret=WEBHOOK_SECRET, record_path=WEBHOOK_RECORD_PATH):
+        self.workers = workers
+        self.secret = secret
+        self.record_path = record_path
+        self.received = 0
+        self.rejected = 0
+        self._queues = []
+        self._processes = []
+        self._record_file = None
+
+    def start_workers(self):
+        context = multiprocessing.get_context("spawn")
+        ready_events = []
+        for index in range(self.workers):
+            updates = context.Queue(WORKER_QUEUE_SIZE)
+            ready = context.Event()
+            process = context.Process(
+                target=_worker_main, args=(index, self.workers, updates, ready), name=f"starbutts-worker-{index}"
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+            ready_events.append(ready)
+        for index, ready in enumerate(ready_events):
+            if not ready.wait(WORKER_START_TIMEOUT):
+                raise RuntimeError(f"Рабочий процесс {index} не запустился за {WORKER_START_TIMEOUT} с")
+        if self.record_path:
+            self._record_file = open(self.record_path, "a", encoding="utf-8")
+        logger.info(f"Запущено рабочих процессов: {self.workers}")
+
+    def stop_workers(self):
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join()
+        if self._record_file:
+            self._record_file.close()
+
+    async def handle_update(self, request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        body = await request.text()
+        try:
+            user_id = update_user_id(json.loads(body))
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            self._queues[user_id % self.workers].put_nowait(body)
+        except queue.Full:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        if self._record_file:
+            self._record_file.write(body.replace("\n", " ") + "\n")
+        return web.Response()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        return app
+
+
+async def _set_webhook(url, secret, token, base_url=None):
+    from telegram import Bot
+
+    async with Bot(token=token, **({"base_url": f"{base_url}/bot"} if base_url else {})) as bot:
+        await bot.set_webhook(url=f"{url.rstrip('/')}{WEBHOOK_PATH}", secret_token=secret)
+
+
+# Запуск в режиме webhook: регистрация адреса в Telegram (если url задан), рабочие процессы и HTTP-сервер
+def run_webhook(url=None, token=None, base_url=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT, workers=WEBHOOK_WORKERS):
+    if url:
+        asyncio.run(_set_webhook(url, WEBHOOK_SECRET, token, base_url))
+    dispatcher = WebhookDispatcher(workers)
+    dispatcher.start_workers()
+    try:
+        web.run_app(dispatcher.create_app(), host=host, port=port, access_log=None)
+    finally:
+        dispatcher.stop_workers()
+
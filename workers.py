@@ -0,0 +1,14 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Блокирующие операции: геокодирование, поиск часового пояса, файлы
+BLOCKING_WORKERS = 8
+
+blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+# Выполнение блокирующей функции в пуле, не останавливая цикл событий
+async def run_in_pool(pool, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))